@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2017, Stadt Karlsruhe (www.karlsruhe.de)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Benchmark for the compact tables of the budget export.
+
+Compares the tables of a (generated or given) document with their
+compact copies (see ``Table.compact``): Checks that the list operations
+give the same results for both and reports the size of their pickles
+and the time for iterating over their records.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import logging
+import os.path
+import pickle
+import shutil
+import sys
+import tempfile
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import budget_export
+from generate_documents import DocumentGenerator
+
+
+def load_tables(filename):
+    return budget_export.load_word_file(filename,
+                                        budget_export._HeadingState())
+
+
+def _result(operation):
+    '''
+    Return the result of an operation or the type of its exception.
+    '''
+    try:
+        return operation()
+    except Exception as e:
+        return type(e)
+
+
+def _operations(table):
+    '''
+    Return the list operations that are compared, as functions of a
+    table and of the same table as a plain list.
+    '''
+    first = table[0] if len(table) else None
+    return [
+        ('len', lambda t, l: len(t)),
+        ('bool', lambda t, l: bool(t)),
+        ('iter', lambda t, l: list(iter(t))),
+        ('reversed', lambda t, l: list(reversed(t))),
+        ('getitem', lambda t, l: [t[i] for i in range(-len(t), len(t))]),
+        ('getitem out of range', lambda t, l: t[len(t)]),
+        ('slice', lambda t, l: t[1:-1]),
+        ('step slice', lambda t, l: t[::2]),
+        ('contains', lambda t, l: first in t),
+        ('count', lambda t, l: t.count(first)),
+        ('index', lambda t, l: t.index(first)),
+        ('index missing', lambda t, l: t.index({})),
+        ('add', lambda t, l: t + []),
+        ('add list', lambda t, l: t + l),
+        ('radd', lambda t, l: [] + t),
+        ('mul', lambda t, l: t * 2),
+        ('rmul', lambda t, l: 2 * t),
+        ('eq', lambda t, l: (t == l, l == t, t == t)),
+        ('ne', lambda t, l: (t != l, l != t, t != [])),
+        ('lt', lambda t, l: (t < l, l < t, t < l + [{}])),
+        ('le', lambda t, l: (t <= l, l <= t)),
+        ('gt', lambda t, l: (t > l, l > t, t > [])),
+        ('ge', lambda t, l: (t >= l, l >= t)),
+        ('sorted', lambda t, l: sorted(t, key=len)),
+        ('pickle', lambda t, l: list(pickle.loads(pickle.dumps(t, 2)))),
+    ]
+
+
+def check(tables):
+    '''
+    Check that the list operations give the same results for each
+    table and its compact copy.
+
+    Raises ``AssertionError`` if a result differs.
+    '''
+    for table in tables:
+        compact = table.compact()
+        records = list(table)
+        assert list(compact) == records, table
+        for name, operation in _operations(table):
+            expected = _result(lambda: operation(table, records))
+            result = _result(lambda: operation(compact, records))
+            assert result == expected, (name, type(table).__name__)
+            # Same result type as for the original table
+            assert type(result) is type(expected), name
+
+
+def run(tables, repeat=5):
+    '''
+    Compare the tables with their compact copies.
+
+    Returns a list of ``(name, pickled bytes, seconds for iterating)``
+    tuples.
+    '''
+    results = []
+    compact = [table.compact() for table in tables]
+    for name, items in [('full', tables), ('compact', compact)]:
+        size = len(pickle.dumps(items, pickle.HIGHEST_PROTOCOL))
+        seconds = min(timeit.repeat(
+                      lambda: [list(table) for table in items], number=1,
+                      repeat=repeat))
+        results.append((name, size, seconds))
+    return results
+
+
+def format_results(results):
+    lines = ['{:<10} {:>12} {:>12}'.format('tables', 'pickle KB',
+                                           'iterate ms')]
+    for name, size, seconds in results:
+        lines.append('{:<10} {:>12.0f} {:>12.1f}'.format(name, size / 1024,
+                                                         seconds * 1000))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check and benchmark ' +
+                                     'the compact tables of the budget ' +
+                                     'export.')
+    parser.add_argument('filename', metavar='DOCX', nargs='?',
+                        help='Input file. If none is given then a ' +
+                        'synthetic document is generated.')
+    parser.add_argument('--teilhaushalte', '-t', type=int, default=20,
+                        help='Number of Teilhaushalte in the generated ' +
+                        'document (default: 20)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of ' +
+                        'repetitions, the best time is reported (default: 5)')
+    args = parser.parse_args()
+
+    budget_export.log.setLevel(logging.ERROR)
+
+    directory = None
+    filename = args.filename
+    if not filename:
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'budget.docx')
+        DocumentGenerator(teilhaushalte=args.teilhaushalte).write(filename)
+    try:
+        tables = load_tables(filename)
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+    check(tables)
+    print(format_results(run(tables, args.repeat)))
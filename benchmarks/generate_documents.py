@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2017, Stadt Karlsruhe (www.karlsruhe.de)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Generate synthetic KM-Doppik budget documents for benchmarking.
+
+The documents mimic the structure of the Word files produced by the
+"Ein-Knopf-Lösung" of KM-Doppik: The Gesamtergebnishaushalt and the
+Gesamtfinanzhaushalt are followed by the Teilhaushalte, each of which
+contains a Teilfinanzhaushalt, an Investitionsübersicht (with merged
+project rows) and Teilergebnishaushalte for its Produktbereiche and
+Produktgruppen. Some Teilhaushalte contain a Verrechnungen section
+instead and some contain tables of an unknown type.
+
+Like in the original documents, each Teilergebnishaushalt is preceded
+by the complete headings of its Teilhaushalt, Produktbereich and
+Produktgruppe. The export only resets the Produktbereich and the
+Produktgruppe at the heading of a Teilhaushalt (see ``_HeadingState``
+in ``budget_export.py``).
+
+The generated files contain only the parts of a ``.docx`` package that
+are necessary for opening them with python-docx.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+VALUE_COLUMNS = [('Ergebnis', 2015), ('Ansatz', 2016), ('Ansatz', 2017),
+                 ('Plan', 2018)]
+
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">\
+<Default Extension="rels" \
+ContentType="application/vnd.openxmlformats-package.relationships+xml"/>\
+<Default Extension="xml" ContentType="application/xml"/>\
+<Override PartName="/word/document.xml" ContentType="application/\
+vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>\
+</Types>'''
+
+PACKAGE_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships \
+xmlns="http://schemas.openxmlformats.org/package/2006/relationships">\
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/\
+officeDocument/2006/relationships/officeDocument" \
+Target="word/document.xml"/></Relationships>'''
+
+
+def format_amount(cents, decimals=2):
+    '''
+    Format an amount given in cents as a German amount string.
+    '''
+    s = '{:,}'.format(abs(cents) // 100).replace(',', '.')
+    if decimals == 1:
+        s += ',{}'.format(abs(cents) % 100 // 10)
+    elif decimals == 2:
+        s += ',{:02d}'.format(abs(cents) % 100)
+    return ('-' if cents < 0 else '') + s
+
+
+def paragraph(text):
+    '''
+    Create the XML for a paragraph.
+
+    Newlines in ``text`` start a new paragraph and tabs are converted to
+    ``w:tab`` elements.
+    '''
+    paragraphs = []
+    for line in text.split('\n'):
+        runs = []
+        for i, segment in enumerate(line.split('\t')):
+            if i:
+                runs.append('<w:r><w:tab/></w:r>')
+            if segment:
+                runs.append('<w:r><w:t xml:space="preserve">{}</w:t></w:r>'
+                            .format(escape(segment)))
+        paragraphs.append('<w:p>{}</w:p>'.format(''.join(runs)))
+    return ''.join(paragraphs)
+
+
+def cell(text, span=1, vmerge=None):
+    '''
+    Create the XML for a table cell.
+
+    ``span`` is the number of grid columns that the cell spans.
+    ``vmerge`` is either ``None``, ``'restart'`` or ``'continue'``.
+    '''
+    properties = ''
+    if span > 1:
+        properties += '<w:gridSpan w:val="{}"/>'.format(span)
+    if vmerge == 'restart':
+        properties += '<w:vMerge w:val="restart"/>'
+    elif vmerge == 'continue':
+        properties += '<w:vMerge/>'
+        text = ''
+    if properties:
+        properties = '<w:tcPr>{}</w:tcPr>'.format(properties)
+    return '<w:tc>{}{}</w:tc>'.format(properties, paragraph(text))
+
+
+def table(meta_headers, rows):
+    '''
+    Create the XML for a table.
+
+    ``meta_headers`` is a list of labels for the meta columns. The
+    labels of the value columns are taken from ``VALUE_COLUMNS``. The
+    first two meta columns span both header rows.
+
+    ``rows`` is a list of body rows. A row is either a list of cell
+    texts or a 1-tuple containing the text of a single cell that spans
+    the whole row.
+    '''
+    num_columns = len(meta_headers) + len(VALUE_COLUMNS)
+    xml = ['<w:tbl><w:tblPr/><w:tblGrid>', '<w:gridCol/>' * num_columns,
+           '</w:tblGrid>']
+    header = [cell(label, vmerge='restart' if i < 2 else None)
+              for i, label in enumerate(meta_headers)]
+    header.extend(cell('{}\n{}\nEUR'.format(type, year))
+                  for type, year in VALUE_COLUMNS)
+    xml.append('<w:tr>{}</w:tr>'.format(''.join(header)))
+    numbers = [cell('', vmerge='continue') if i < 2 else cell(str(i + 1))
+               for i in range(num_columns)]
+    xml.append('<w:tr>{}</w:tr>'.format(''.join(numbers)))
+    for row in rows:
+        if isinstance(row, tuple):
+            cells = cell(row[0], span=num_columns)
+        else:
+            cells = ''.join(cell(text) for text in row)
+        xml.append('<w:tr>{}</w:tr>'.format(cells))
+    xml.append('</w:tbl>')
+    return ''.join(xml)
+
+
+class DocumentGenerator(object):
+    '''
+    Generator for the XML of synthetic budget documents.
+
+    ``teilhaushalte``, ``produktbereiche`` and ``produktgruppen`` are
+    the number of Teilhaushalte, Produktbereiche per Teilhaushalt and
+    Produktgruppen per Produktbereich. ``rows`` is the approximate
+    number of body rows per table.
+    '''
+    def __init__(self, teilhaushalte=10, produktbereiche=3, produktgruppen=3,
+                 rows=20, seed=0):
+        self.teilhaushalte = teilhaushalte
+        self.produktbereiche = produktbereiche
+        self.produktgruppen = produktgruppen
+        self.rows = rows
+        self.random = random.Random(seed)
+
+    def amount(self):
+        '''
+        Create a random amount.
+
+        Some amounts have no decimals or a single decimal.
+
+        Returns the amount as a German amount string and as cents.
+        '''
+        cents = self.random.randint(-10 ** 9, 10 ** 9)
+        k = self.random.random()
+        if k < 0.1:
+            cents -= cents % 10 if cents >= 0 else -(-cents % 10)
+            decimals = 1
+        elif k < 0.2:
+            cents -= cents % 100 if cents >= 0 else -(-cents % 100)
+            decimals = 0
+        else:
+            decimals = 2
+        return format_amount(cents, decimals), cents
+
+    def values(self):
+        '''
+        Create the value cells of a row.
+
+        Returns a list of amount strings and a list of cents.
+        '''
+        amounts = [self.amount() for _ in VALUE_COLUMNS]
+        return [a[0] for a in amounts], [a[1] for a in amounts]
+
+    def value_rows(self, num_rows, kontogruppe=False, summaries=True):
+        '''
+        Create body rows for a table.
+
+        Positions (with number and sign) are followed by optional child
+        rows. If ``summaries`` is true then there are also summary rows,
+        rows without values and rows with a number but without a sign.
+        The summary rows contain the sum of the positions since the
+        previous summary row or the sum of all previous positions.
+        '''
+        def meta(number, sign, title, kg=''):
+            cells = [number, sign, title]
+            if kontogruppe:
+                cells.insert(1, kg)
+            return cells
+
+        rows = []
+        number = 1
+        block = [0] * len(VALUE_COLUMNS)
+        total = [0] * len(VALUE_COLUMNS)
+        while len(rows) < num_rows:
+            values, cents = self.values()
+            rows.append(meta(str(number), self.random.choice('+-'),
+                             'Position {}\n  Titel'.format(number),
+                             str(self.random.randint(40, 49))) + values)
+            block = [a + b for a, b in zip(block, cents)]
+            total = [a + b for a, b in zip(total, cents)]
+            number += 1
+            for i in range(self.random.randint(0, 2)):
+                rows.append(meta('', '', ' Unterposition  {} '.format(i)) +
+                            self.values()[0])
+            if not summaries:
+                continue
+            k = self.random.random()
+            if k < 0.15:
+                summary = total if k < 0.05 else block
+                rows.append(meta(str(number), '=', 'Summe') +
+                            [format_amount(c) for c in summary])
+                block = [0] * len(VALUE_COLUMNS)
+                number += 1
+            elif k < 0.25:
+                rows.append(meta('', '', 'Leerzeile') +
+                            [''] * len(VALUE_COLUMNS))
+            elif k < 0.3:
+                rows.append(meta(str(number), '', 'Ohne Vorzeichen') +
+                            ['1,00'] * len(VALUE_COLUMNS))
+        return rows
+
+    def investment_rows(self, teilhaushalt):
+        rows = []
+        for project in range(3):
+            rows.append(('7.{}{:03d}: Projekt\t{}'.format(
+                         teilhaushalt, project, project),))
+            rows.extend(self.value_rows(max(1, self.rows // 3),
+                                        summaries=False))
+        return rows
+
+    def body(self):
+        '''
+        Generate the XML of the blocks in the document body.
+        '''
+        yield paragraph('Gesamtergebnishaushalt')
+        yield table(['Nr.', 'Vz.', 'Gesamtergebnishaushalt'],
+                    self.value_rows(self.rows))
+        yield paragraph('Gesamtfinanzhaushalt')
+        yield table(['Nr.', 'Vz.', 'Gesamtfinanzhaushalt'],
+                    self.value_rows(self.rows))
+        for thh in range(1, self.teilhaushalte + 1):
+            thh_heading = paragraph('THH{} Teilhaushalt {}'.format(thh, thh))
+            yield thh_heading
+            if thh % 5 == 0:
+                yield paragraph('9 Verrechnungen')
+                yield table(['Nr.', 'KG', 'Vz.', 'Teilergebnishaushalt'],
+                            self.value_rows(self.rows, kontogruppe=True))
+                continue
+            yield table(['Nr.', 'Vz.', 'Teilfinanzhaushalt'],
+                        self.value_rows(self.rows))
+            yield table(['Nr.', 'Vz.', 'Investitionsübersicht'],
+                        self.investment_rows(thh))
+            yield paragraph('')
+            for pb in range(1, self.produktbereiche + 1):
+                pb_id = '{:02d}'.format(10 + pb)
+                pb_heading = paragraph('{} Produktbereich {}'.format(pb_id,
+                                                                     pb))
+                yield thh_heading
+                yield pb_heading
+                yield table(['Nr.', 'KG', 'Vz.', 'Teilergebnishaushalt'],
+                            self.value_rows(self.rows, kontogruppe=True))
+                for pg in range(1, self.produktgruppen + 1):
+                    yield thh_heading
+                    yield pb_heading
+                    yield paragraph('{}{:02d} Produktgruppe {}'.format(
+                                    pb_id, pg, pg))
+                    yield table(['Nr.', 'KG', 'Vz.', 'Teilergebnishaushalt'],
+                                self.value_rows(self.rows, kontogruppe=True))
+            if thh % 4 == 0:
+                yield table(['A', 'B', 'Unbekannt', 'X'],
+                            [['1', '2', '3', '4', '5', '6', '7', '8']])
+
+    def document_xml(self):
+        return ''.join([
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n',
+            '<w:document xmlns:w="{}"><w:body>'.format(W_NS),
+            ''.join(self.body()),
+            '<w:sectPr/></w:body></w:document>',
+        ]).encode('utf-8')
+
+    def write(self, filename):
+        '''
+        Write the document to a ``.docx`` file.
+        '''
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('[Content_Types].xml', CONTENT_TYPES)
+            archive.writestr('_rels/.rels', PACKAGE_RELS)
+            archive.writestr('word/document.xml', self.document_xml())
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate synthetic ' +
+                                     'KM-Doppik budget documents.')
+    parser.add_argument('filename', metavar='DOCX', help='Output file')
+    parser.add_argument('--teilhaushalte', '-t', type=int, default=10,
+                        help='Number of Teilhaushalte (default: 10)')
+    parser.add_argument('--produktbereiche', '-b', type=int, default=3,
+                        help='Number of Produktbereiche per Teilhaushalt ' +
+                        '(default: 3)')
+    parser.add_argument('--produktgruppen', '-g', type=int, default=3,
+                        help='Number of Produktgruppen per Produktbereich ' +
+                        '(default: 3)')
+    parser.add_argument('--rows', '-r', type=int, default=20,
+                        help='Approximate number of rows per table ' +
+                        '(default: 20)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the random number generator')
+    args = parser.parse_args()
+
+    DocumentGenerator(args.teilhaushalte, args.produktbereiche,
+                      args.produktgruppen, args.rows, args.seed
+                      ).write(args.filename)
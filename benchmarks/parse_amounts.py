@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2017, Stadt Karlsruhe (www.karlsruhe.de)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Micro-benchmark for parsing the amounts of a table.
+
+Compares ``parse_amounts``, which parses a list of amount strings in a
+single pass, with calling ``parse_amount`` for each string, and checks
+that both give the same results. Besides generated amounts, the check
+covers edge cases and random strings, including strings that are not
+handled by the fast path of ``parse_amounts`` or cannot be parsed at
+all. The results are compared including their sign and exponent, so
+``-0,00`` and ``0,00`` are different.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os.path
+import random
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import budget_export
+from generate_documents import DocumentGenerator
+
+
+EDGE_CASES = [
+    # Empty strings and signs without digits
+    '', '-', '+',
+    # No, one, two and more digits in the fraction
+    '0', '17', '1,5', '-1,5', '1,05', '1,234', '1,', ',5', '-,5',
+    # Zeros
+    '0,00', '-0,00', '-0', '+0,0',
+    # Thousands separators
+    '1.234.567,89', '-1.234,5', '1.', '.1', '1..2,3',
+    # Fallback to ``parse_amount``
+    '1,2 ', ' 1,00', '1,0x', '1e5', '--1', '+-1', '1,2,3', 'NaN', 'xx',
+    '١٢,5',
+]
+
+# Strings containing NUL characters make ``parse_amounts`` use the
+# fallback for all strings.
+NUL_CASES = ['1,00', '2\x00,00', '-3']
+
+
+def random_strings(count, seed=0):
+    '''
+    Generate random strings from the characters of amount strings.
+    '''
+    rng = random.Random(seed)
+    alphabet = '0123456789' * 3 + '.,-+ x'
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 10)))
+            for _ in range(count)]
+
+
+def generated_amounts(count, seed=0):
+    '''
+    Generate amount strings like those in the generated documents.
+    '''
+    generator = DocumentGenerator(seed=seed)
+    return [generator.amount()[0] for _ in range(count)]
+
+
+def _result(parse, s):
+    '''
+    Return the result of parsing a string in a comparable form.
+
+    Amounts are returned as their ``as_tuple()``, exceptions as their
+    type.
+    '''
+    try:
+        return parse(s).as_tuple()
+    except Exception as e:
+        return type(e)
+
+
+def check(strings):
+    '''
+    Check that ``parse_amounts`` gives the same results as
+    ``parse_amount``.
+
+    Raises ``AssertionError`` if a result differs.
+    '''
+    expected = [_result(budget_export.parse_amount, s) for s in strings]
+    for s, result in zip(strings, expected):
+        assert _result(lambda s: budget_export.parse_amounts([s])[0],
+                       s) == result, repr(s)
+    valid = [s for s, result in zip(strings, expected)
+             if isinstance(result, tuple)]
+    results = [amount.as_tuple() for amount
+               in budget_export.parse_amounts(valid)]
+    assert results == [result for result in expected
+                       if isinstance(result, tuple)]
+
+
+def check_all(amounts):
+    '''
+    Check the edge cases, random strings and the given amounts, with
+    and without the optimization for the pure Python ``decimal``.
+    '''
+    cases = [EDGE_CASES, NUL_CASES, random_strings(10000), amounts]
+    dec_from_triple = budget_export._dec_from_triple
+    try:
+        for value in {dec_from_triple, None}:
+            budget_export._dec_from_triple = value
+            for strings in cases:
+                check(strings)
+    finally:
+        budget_export._dec_from_triple = dec_from_triple
+
+
+def run(amounts, repeat=5):
+    '''
+    Time parsing the amounts.
+
+    Returns the best times of calling ``parse_amount`` for each string
+    and of ``parse_amounts``.
+    '''
+    def original():
+        return [budget_export.parse_amount(s) for s in amounts]
+
+    def current():
+        return budget_export.parse_amounts(amounts)
+
+    return (min(timeit.repeat(original, number=1, repeat=repeat)),
+            min(timeit.repeat(current, number=1, repeat=repeat)))
+
+
+def format_results(count, original, current):
+    return '\n'.join([
+        '{:<24} {:>9} {:>12} {:>12} {:>8}'.format(
+            'function', 'strings', 'old ns/call', 'ns/call', 'speedup'),
+        '{:<24} {:>9} {:>12.0f} {:>12.0f} {:>7.2f}x'.format(
+            'parse_amounts', count, original / count * 1e9,
+            current / count * 1e9, original / current),
+    ])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check and benchmark ' +
+                                     'parsing the amounts of a table.')
+    parser.add_argument('--count', '-n', type=int, default=100000,
+                        help='Number of generated amounts (default: 100000)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of ' +
+                        'repetitions, the best time is reported (default: 5)')
+    args = parser.parse_args()
+
+    amounts = generated_amounts(args.count)
+    check_all(amounts)
+    print(format_results(len(amounts), *run(amounts, args.repeat)))
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2017, Stadt Karlsruhe (www.karlsruhe.de)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Benchmarks for the stages of the budget export pipeline.
+
+Each stage is run in a separate process, so that the reported peak
+memory usage (RSS) is that of the stage alone. The inputs of a stage
+are prepared before the timer is started.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import OrderedDict
+import json
+import logging
+import multiprocessing
+import os.path
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from lxml import etree
+
+import budget_export
+from generate_documents import DocumentGenerator
+
+
+def peak_rss():
+    '''
+    Return the peak resident set size of the process in bytes.
+    '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        return rss
+    return rss * 1024
+
+
+def iter_elements(filenames):
+    for filename in filenames:
+        for element in budget_export.iter_docx_blocks(filename):
+            yield element
+
+
+def load_table_data(filenames):
+    return [budget_export.extract_data(element)
+            for element in iter_elements(filenames)
+            if element.tag == budget_export._W_TBL]
+
+
+def setup_read(filenames):
+    def run():
+        counts = {'tables': 0, 'paragraphs': 0}
+        for element in iter_elements(filenames):
+            if element.tag == budget_export._W_TBL:
+                counts['tables'] += 1
+            else:
+                counts['paragraphs'] += 1
+        return counts
+    return run
+
+
+def setup_headings(filenames):
+    texts = [budget_export.paragraph_text(element)
+             for element in iter_elements(filenames)
+             if element.tag == budget_export._W_P]
+
+    def run():
+        headings = budget_export._HeadingState()
+        for text in texts:
+            headings.register_heading(text)
+        return {'headings': len(texts)}
+    return run
+
+
+def setup_extract_data(filenames):
+    elements = [etree.fromstring(etree.tostring(element))
+                for element in iter_elements(filenames)
+                if element.tag == budget_export._W_TBL]
+
+    def run():
+        rows = 0
+        for element in elements:
+            rows += len(budget_export.extract_data(element))
+        return {'tables': len(elements), 'rows': rows}
+    return run
+
+
+def setup_table_from_data(filenames):
+    tables = load_table_data(filenames)
+
+    def run():
+        for data in tables:
+            try:
+                budget_export.table_from_data(data)
+            except budget_export.UnknownTableTypeException:
+                pass
+        return {'tables': len(tables),
+                'rows': sum(len(data) for data in tables)}
+    return run
+
+
+class _CountingWriter(object):
+
+    def __init__(self, writer):
+        self.rows = 0
+        self._writer = writer
+
+    def writerow(self, row):
+        self.rows += 1
+        self._writer.writerow(row)
+
+    def writerows(self, rows):
+        rows = list(rows)
+        self.rows += len(rows)
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._writer.close()
+
+
+def setup_dump_csv(filenames):
+    headings = budget_export._HeadingState()
+    tables = list(budget_export.load_word_files(filenames, headings))
+
+    def run():
+        rows = 0
+        directory = tempfile.mkdtemp()
+        try:
+            for dataset in budget_export.DATASETS:
+                writer = _CountingWriter(budget_export.CsvWriter(
+                                         os.path.join(directory, dataset.name),
+                                         dataset.header))
+                for table in tables:
+                    if dataset.table_filter(table):
+                        dataset.dump_table(table, writer)
+                writer.close()
+                rows += writer.rows
+        finally:
+            shutil.rmtree(directory)
+        return {'tables': len(tables), 'rows': rows}
+    return run
+
+
+def setup_export(filenames):
+    filenames = [os.path.abspath(filename) for filename in filenames]
+
+    def run():
+        cwd = os.getcwd()
+        directory = tempfile.mkdtemp()
+        try:
+            os.chdir(directory)
+            headings = budget_export._HeadingState()
+            counts = {'tables': 0}
+
+            def count(tables):
+                for table in tables:
+                    counts['tables'] += 1
+                    yield table
+
+            budget_export.export_tables(count(budget_export.load_word_files(
+                                        filenames, headings)), headings)
+            return counts
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(directory)
+    return run
+
+
+STAGES = OrderedDict([
+    ('read', setup_read),
+    ('headings', setup_headings),
+    ('extract_data', setup_extract_data),
+    ('table_from_data', setup_table_from_data),
+    ('dump_csv', setup_dump_csv),
+    ('export', setup_export),
+])
+
+
+def _run_stage(name, filenames, repeat, queue):
+    try:
+        run = STAGES[name](filenames)
+        rss_before = peak_rss()
+        times = []
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            counts = run()
+            times.append(timeit.default_timer() - start)
+        queue.put({
+            'stage': name,
+            'seconds': min(times),
+            'counts': counts,
+            'peak_rss': peak_rss(),
+            'peak_rss_increase': peak_rss() - rss_before,
+        })
+    except Exception as e:
+        queue.put({'stage': name, 'error': repr(e)})
+        raise
+
+
+def run_stage(name, filenames, repeat=3):
+    '''
+    Run a benchmark stage in a separate process.
+
+    Returns a dict with the results.
+    '''
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_stage,
+                                      args=(name, filenames, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def format_results(results):
+    units = ['tables', 'rows', 'headings']
+    lines = ['{:<16} {:>9} {:>12} {:>12} {:>12} {:>10} {:>10}'.format(
+             'stage', 'seconds', *(['{}/s'.format(unit) for unit in units] +
+                                   ['peak MB', 'stage MB']))]
+    for result in results:
+        if 'error' in result:
+            lines.append('{:<16} {}'.format(result['stage'],
+                                            result['error']))
+            continue
+        counts = result['counts']
+        rates = []
+        for unit in units:
+            if unit in counts and result['seconds']:
+                rates.append('{:.0f}'.format(counts[unit] /
+                                             result['seconds']))
+            else:
+                rates.append('-')
+        lines.append(('{:<16} {:>9.3f} {:>12} {:>12} {:>12} {:>10.1f} ' +
+                      '{:>10.1f}').format(
+                     result['stage'], result['seconds'], *(rates + [
+                     result['peak_rss'] / 1024 ** 2,
+                     result['peak_rss_increase'] / 1024 ** 2])))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the stages of ' +
+                                     'the budget export.')
+    parser.add_argument('filenames', metavar='DOCX', nargs='*',
+                        help='Input files. If none are given then a ' +
+                        'synthetic document is generated.')
+    parser.add_argument('--teilhaushalte', '-t', type=int, default=50,
+                        help='Number of Teilhaushalte in the generated ' +
+                        'document (default: 50)')
+    parser.add_argument('--rows', '-r', type=int, default=20,
+                        help='Approximate number of rows per table in the ' +
+                        'generated document (default: 20)')
+    parser.add_argument('--stage', '-s', action='append',
+                        choices=list(STAGES), help='Stage to run (can be ' +
+                        'specified multiple times, defaults to all stages)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of ' +
+                        'repetitions, the best time is reported (default: 3)')
+    parser.add_argument('--json', action='store_true',
+                        help='Output the results as JSON')
+    args = parser.parse_args()
+
+    # Don't benchmark the output of warnings about unknown tables
+    budget_export.log.setLevel(logging.ERROR)
+
+    directory = None
+    filenames = args.filenames
+    if not filenames:
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'budget.docx')
+        DocumentGenerator(teilhaushalte=args.teilhaushalte,
+                          rows=args.rows).write(filename)
+        filenames = [filename]
+    try:
+        results = [run_stage(stage, filenames, args.repeat)
+                   for stage in (args.stage or STAGES)]
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print(format_results(results))
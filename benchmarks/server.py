@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2017, Stadt Karlsruhe (www.karlsruhe.de)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Benchmark for the HTTP server of the budget export.
+
+Starts an ``ExportServer`` on an ephemeral port of localhost and checks
+its responses to a valid upload, to uploads that are not a Word document,
+contain malformed amounts or have an invalid length, and to an upload
+while the queue is full.
+Then it measures the time per upload of a (generated or given) document.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import contextlib
+import httplib
+import io
+import logging
+import os.path
+import sys
+import threading
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import budget_export
+from generate_documents import DocumentGenerator
+
+
+class _MalformedDocumentGenerator(DocumentGenerator):
+    '''
+    Generator for documents whose amounts cannot be parsed.
+    '''
+    def amount(self):
+        return 'xx', 0
+
+
+def generate(generator):
+    '''
+    Return the content of a ``.docx`` file created by a generator.
+    '''
+    f = io.BytesIO()
+    generator.write(f)
+    return f.getvalue()
+
+
+@contextlib.contextmanager
+def running_server(jobs=1, max_queue=16):
+    '''
+    Context manager that runs an ``ExportServer`` in a thread.
+
+    Yields the server, its port is ``server.server_address[1]``.
+    '''
+    server = budget_export.ExportServer(('localhost', 0), jobs, max_queue)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def post(server, name, data):
+    '''
+    Upload data to a server.
+
+    Returns the status and the body of the response.
+    '''
+    connection = httplib.HTTPConnection(*server.server_address)
+    try:
+        # httplib needs byte strings to send a binary body
+        connection.request(b'POST', ('/' + name).encode('ascii'), data)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def check(server, data):
+    '''
+    Check the responses of a server.
+
+    ``data`` is the content of a valid Word document. Raises
+    ``AssertionError`` if a response is not as expected.
+    '''
+    name = budget_export.DATASETS[0].name
+    header = ','.join('"{}"'.format(label) for label
+                      in budget_export.DATASETS[0].header).encode('utf-8')
+
+    status, body = post(server, name, data)
+    assert status == 200, status
+    assert body.startswith(header), body[:100]
+    assert len(body.splitlines()) > 1
+
+    status, _ = post(server, name, b'not a Word document')
+    assert status == 400, status
+
+    malformed = generate(_MalformedDocumentGenerator(teilhaushalte=1))
+    status, _ = post(server, name, malformed)
+    assert status == 400, status
+
+    status, _ = post(server, 'unknown', data)
+    assert status == 404, status
+
+    # A negative length must not block a slot while reading the body
+    connection = httplib.HTTPConnection(*server.server_address, timeout=10)
+    try:
+        connection.putrequest(b'POST', ('/' + name).encode('ascii'))
+        connection.putheader(b'Content-Length', b'-1')
+        connection.endheaders()
+        assert connection.getresponse().status == 400
+    finally:
+        connection.close()
+
+    # Fill the queue
+    acquired = 0
+    while server.slots.acquire(False):
+        acquired += 1
+    try:
+        status, _ = post(server, name, data)
+        assert status == 503, status
+    finally:
+        for _ in range(acquired):
+            server.slots.release()
+
+    # The server still works after the errors
+    assert post(server, name, data) == (200, body)
+
+
+def run(server, data, repeat=5):
+    '''
+    Return the best time of uploading a document and receiving the
+    first dataset.
+    '''
+    name = budget_export.DATASETS[0].name
+    return min(timeit.repeat(lambda: post(server, name, data), number=1,
+                             repeat=repeat))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check and benchmark the ' +
+                                     'HTTP server of the budget export.')
+    parser.add_argument('filename', metavar='DOCX', nargs='?',
+                        help='Input file. If none is given then a ' +
+                        'synthetic document is generated.')
+    parser.add_argument('--teilhaushalte', '-t', type=int, default=20,
+                        help='Number of Teilhaushalte in the generated ' +
+                        'document (default: 20)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number ' +
+                        'of worker processes of the server (default: 1)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of ' +
+                        'repetitions, the best time is reported (default: 5)')
+    args = parser.parse_args()
+
+    budget_export.log.setLevel(logging.CRITICAL)
+
+    if args.filename:
+        with io.open(args.filename, 'rb') as f:
+            data = f.read()
+    else:
+        data = generate(DocumentGenerator(teilhaushalte=args.teilhaushalte))
+    with running_server(args.jobs, max_queue=2) as server:
+        check(server, data)
+        print('{:.1f} ms per upload'.format(
+              run(server, data, args.repeat) * 1000))
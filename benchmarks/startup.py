@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2017, Stadt Karlsruhe (www.karlsruhe.de)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+Benchmark for the start-up time of the budget export.
+
+Measures the wall-clock time of running the script in a new interpreter
+for commands that do not process any documents, which is the overhead
+of each invocation. The commands are run both via ``budget_export.py``,
+which is compiled on each run, and via the ``budget-export`` script,
+which uses the compiled module. With ``--imports`` the time that is spent importing
+each module is shown instead, similar to ``python -X importtime``
+(which is not available in Python 2).
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import OrderedDict
+import json
+import os.path
+import py_compile
+import subprocess
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(HERE), 'budget_export.py')
+ENTRY_SCRIPT = os.path.join(os.path.dirname(HERE), 'budget-export')
+
+COMMANDS = OrderedDict([
+    ('python', ['-c', 'pass']),
+    ('import', ['-c', 'import budget_export']),
+    ('help', [SCRIPT, '--help']),
+    ('list-layouts', [SCRIPT, '--list-layouts']),
+    ('script help', [ENTRY_SCRIPT, '--help']),
+    ('script list', [ENTRY_SCRIPT, '--list-layouts']),
+])
+
+
+def time_command(args, repeat=10):
+    '''
+    Return the best wall-clock time of running the Python interpreter
+    with the given arguments.
+    '''
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            subprocess.check_call([sys.executable] + args, stdout=devnull,
+                                  cwd=os.path.dirname(SCRIPT))
+            times.append(timeit.default_timer() - start)
+    return min(times)
+
+
+def _trace_imports(module):
+    '''
+    Import a module and record the time spent for importing each module.
+
+    Returns a list of ``(name, self seconds, cumulative seconds, depth)``
+    tuples in the order in which the imports finished.
+    '''
+    import __builtin__
+
+    original_import = __builtin__.__import__
+    results = []
+    # Time spent in nested imports, for each import that is in progress
+    nested = []
+
+    def timed_import(name, globals=None, locals=None, fromlist=None,
+                     level=-1):
+        if name in sys.modules:
+            return original_import(name, globals, locals, fromlist, level)
+        nested.append(0)
+        start = timeit.default_timer()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = timeit.default_timer() - start
+            children = nested.pop()
+            if nested:
+                nested[-1] += elapsed
+            results.append((name, elapsed - children, elapsed, len(nested)))
+
+    __builtin__.__import__ = timed_import
+    try:
+        __import__(module)
+    finally:
+        __builtin__.__import__ = original_import
+    return results
+
+
+def trace_imports(module='budget_export'):
+    '''
+    Import a module in a new interpreter and return the time spent for
+    importing each module, see ``_trace_imports``.
+    '''
+    output = subprocess.check_output([sys.executable, __file__,
+                                      '--trace-imports', module],
+                                     cwd=os.path.dirname(SCRIPT))
+    return json.loads(output.decode('utf-8'))
+
+
+def format_imports(results, limit=None):
+    results = sorted(results, key=lambda result: -result[1])[:limit]
+    lines = ['{:>10} | {:>10} | {}'.format('self [us]', 'cumulative',
+                                           'imported module')]
+    for name, self_time, cumulative, depth in results:
+        lines.append('{:>10.0f} | {:>10.0f} | {}{}'.format(
+                     self_time * 1e6, cumulative * 1e6, '  ' * depth, name))
+    return '\n'.join(lines)
+
+
+def format_results(results):
+    lines = ['{:<16} {:>10}'.format('command', 'ms')]
+    for name, seconds in results.items():
+        lines.append('{:<16} {:>10.1f}'.format(name, seconds * 1000))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the start-up ' +
+                                     'time of the budget export.')
+    parser.add_argument('--repeat', type=int, default=10, help='Number of ' +
+                        'repetitions, the best time is reported (default: ' +
+                        '10)')
+    parser.add_argument('--imports', action='store_true', help='Show the ' +
+                        'time spent for importing each module instead')
+    parser.add_argument('--limit', type=int, default=20, help='Number of ' +
+                        'modules shown by --imports (default: 20)')
+    parser.add_argument('--json', action='store_true',
+                        help='Output the results as JSON')
+    parser.add_argument('--trace-imports', metavar='MODULE',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.trace_imports:
+        sys.path.insert(0, os.path.dirname(SCRIPT))
+        print(json.dumps(_trace_imports(args.trace_imports)))
+    elif args.imports:
+        results = trace_imports()
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(format_imports(results, args.limit))
+    else:
+        # The compiled module may not have been written yet, for example
+        # if PYTHONDONTWRITEBYTECODE is set.
+        py_compile.compile(SCRIPT, doraise=True)
+        results = OrderedDict((name, time_command(command, args.repeat))
+                              for name, command in COMMANDS.items())
+        if args.json:
+            print(json.dumps(results, indent=2))
+        else:
+            print(format_results(results))
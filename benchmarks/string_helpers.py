@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# Copyright (c) 2017, Stadt Karlsruhe (www.karlsruhe.de)
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+'''
+Micro-benchmark for the string helpers that are called for the rows and
+headings of a document.
+
+Compares ``split`` and ``clean_string`` with their original
+implementations, which pass the pattern to ``re.split`` and ``re.sub``
+for each call, and checks that both give the same results.
+'''
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import logging
+import os.path
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import budget_export
+from generate_documents import DocumentGenerator
+
+
+def original_split(s, maxsplit=None):
+    return re.split(r'\s+', s.strip(), maxsplit=maxsplit or 0,
+                    flags=re.UNICODE)
+
+
+def original_clean_string(s):
+    return re.sub(r'\s+', ' ', s.strip())
+
+
+def load_strings(filename):
+    '''
+    Load the strings of a document that the helpers are called for.
+
+    Returns the texts of the paragraphs and the cells of the tables.
+    '''
+    paragraphs = []
+    cells = []
+    for element in budget_export.iter_docx_blocks(filename):
+        if element.tag == budget_export._W_TBL:
+            for row in budget_export.extract_data(element):
+                cells.extend(row)
+        else:
+            paragraphs.append(budget_export.paragraph_text(element))
+    return paragraphs, cells
+
+
+def _variants(paragraphs, cells):
+    return [
+        ('split', paragraphs,
+         lambda: [original_split(s, 1) for s in paragraphs],
+         lambda: [budget_export.split(s, 1) for s in paragraphs]),
+        ('clean_string', cells,
+         lambda: [original_clean_string(s) for s in cells],
+         lambda: [budget_export.clean_string(s) for s in cells]),
+    ]
+
+
+def run(paragraphs, cells, repeat=5):
+    '''
+    Time the helpers on the given strings.
+
+    Returns a list of ``(name, items, original seconds, seconds)``
+    tuples. Raises ``AssertionError`` if a helper gives a different
+    result than its original implementation.
+    '''
+    results = []
+    for name, items, original, current in _variants(paragraphs, cells):
+        assert original() == current(), name
+        results.append((name, len(items),
+                        min(timeit.repeat(original, number=1,
+                                          repeat=repeat)),
+                        min(timeit.repeat(current, number=1,
+                                          repeat=repeat))))
+    return results
+
+
+def format_results(results):
+    lines = ['{:<24} {:>9} {:>12} {:>12} {:>8}'.format(
+             'helper', 'strings', 'old ns/call', 'ns/call', 'speedup')]
+    for name, items, original, current in results:
+        lines.append('{:<24} {:>9} {:>12.0f} {:>12.0f} {:>7.2f}x'.format(
+                     name, items, original / items * 1e9,
+                     current / items * 1e9, original / current))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the string ' +
+                                     'helpers of the budget export.')
+    parser.add_argument('filename', metavar='DOCX', nargs='?',
+                        help='Input file. If none is given then a ' +
+                        'synthetic document is generated.')
+    parser.add_argument('--teilhaushalte', '-t', type=int, default=20,
+                        help='Number of Teilhaushalte in the generated ' +
+                        'document (default: 20)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of ' +
+                        'repetitions, the best time is reported (default: 5)')
+    args = parser.parse_args()
+
+    budget_export.log.setLevel(logging.ERROR)
+
+    directory = None
+    filename = args.filename
+    if not filename:
+        directory = tempfile.mkdtemp()
+        filename = os.path.join(directory, 'budget.docx')
+        DocumentGenerator(teilhaushalte=args.teilhaushalte).write(filename)
+    try:
+        paragraphs, cells = load_strings(filename)
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+    print(format_results(run(paragraphs, cells, args.repeat)))
@@ -24,14 +24,41 @@
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+from array import array
+import collections
 import logging
 from decimal import Decimal
+try:
+    # Constructor of the pure Python implementation of ``decimal``,
+    # see ``parse_amounts``.
+    from decimal import _dec_from_triple
+except ImportError:
+    _dec_from_triple = None
+import contextlib
+import errno
+import functools
+import importlib
+import io
+import itertools
+import json
+import mmap
+import numbers
+import operator
+import os
+import posixpath
 import re
+import signal
+import threading
+import timeit
+import zipfile
 
-from backports import csv
-from docx import Document
-from docx.table import Table as WordTable
-from docx.text.paragraph import Paragraph
+import BaseHTTPServer
+import SocketServer
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 
 __version__ = '0.1.0'
@@ -46,33 +73,303 @@ log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
 
-# Adapated from https://github.com/python-openxml/python-docx/issues/276
-def iter_block_items(parent):
+class _LazyModule(object):
     '''
-    Generate a reference to each paragraph and table child within *parent*,
-    in document order. Each returned value is an instance of either Table or
-    Paragraph. *parent* would most commonly be a reference to a main
-    Document object, but also works for a _Cell object, which itself can
-    contain paragraphs and tables.
+    A module that is imported when one of its attributes is first used.
+
+    Importing lxml takes most of the start-up time of the script, so it
+    (like the other modules that are not needed by every run) is only
+    imported on the code paths that need it. The attributes are stored
+    in the instance once they have been looked up, so that later
+    accesses are not slower than for the module itself.
+
+    This is only used for ``lxml.etree``, which is used in many places.
+    Other modules are imported locally by the functions that need them.
     '''
-    from docx.document import Document as _Document
-    from docx.oxml.text.paragraph import CT_P
-    from docx.oxml.table import CT_Tbl
-    from docx.table import _Cell
+    def __init__(self, name):
+        self._name = name
 
-    if isinstance(parent, _Document):
-        parent_elm = parent.element.body
-    elif isinstance(parent, _Cell):
-        parent_elm = parent._tc
-    else:
-        raise ValueError('Unknown parent class {}'.format(
-                         parent.__class__.__name__))
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        setattr(self, attr, value)
+        return value
+
+
+etree = _LazyModule('lxml.etree')
+
+
+_PACKAGE_RELS = '_rels/.rels'
+_OFFICE_DOCUMENT_REL_TYPE = ('http://schemas.openxmlformats.org/' +
+                             'officeDocument/2006/relationships/officeDocument')
+_PR_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_W_BODY = '{%s}body' % _W_NS
+_W_P = '{%s}p' % _W_NS
+_W_TBL = '{%s}tbl' % _W_NS
+_W_VAL = '{%s}val' % _W_NS
+_W_NSMAP = {'w': _W_NS}
+
+# Text content of runs, see ``docx.oxml.text.run.CT_R.text``
+_RUN_CONTENT_TEXT = {
+    '{%s}tab' % _W_NS: '\t',
+    '{%s}br' % _W_NS: '\n',
+    '{%s}cr' % _W_NS: '\n',
+}
+_RUN_CONTENT = 'w:r/w:t | w:r/w:tab | w:r/w:br | w:r/w:cr'
+
+
+class _XPaths(object):
+    '''
+    XPath expressions for extracting text and tables from the XML.
+
+    The expressions are compiled when they are first used, see
+    ``_LazyModule``.
+    '''
+    _expressions = {
+        'paragraph_text': _RUN_CONTENT,
+        'cell_text': 'w:p | ' + ' | '.join('w:p/' + p for p
+                                            in _RUN_CONTENT.split(' | ')),
+        'grid_cols': 'w:tblGrid/w:gridCol',
+        'rows': 'w:tr',
+        'cells': 'w:tc',
+        'grid_span': 'w:tcPr/w:gridSpan/@w:val',
+        'vmerge': 'w:tcPr/w:vMerge',
+    }
+
+    def __getattr__(self, name):
+        try:
+            expression = self._expressions[name]
+        except KeyError:
+            raise AttributeError(name)
+        xpath = etree.XPath(expression, namespaces=_W_NSMAP)
+        setattr(self, name, xpath)
+        return xpath
+
+
+_xpath = _XPaths()
+
+
+_clock = timeit.default_timer
+
+
+class Metrics(object):
+    '''
+    Timers and counters for the stages of the export.
+
+    The timers record the total time and the number of calls of a stage:
+
+    - ``zip_open``: Opening a Word file and its main document part
+    - ``xml_parse``: Parsing the XML of the main document part
+    - ``block_iteration``: Releasing the blocks of the document once
+      they have been processed
+    - ``headings``: Tracking the headings of the document
+    - ``extract_data``: Extracting the cell texts of a table
+    - ``table_from_data``: Creating a ``Table`` from the cell texts,
+      this includes ``parse``
+    - ``parse``: Parsing the headers and rows of a table
+    - ``write``: Writing the tables to the output files
+
+    The counters include the number of files, of data rows and of
+    tables per table type. Stages that run in worker processes are
+    included, so their times may add up to more than the wall time.
+
+    The module-level instance ``metrics`` collects the metrics of all
+    stages.
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+
+    def add_time(self, name, seconds):
+        '''
+        Add the duration of a call to a timer.
+        '''
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [seconds, 1]
+        else:
+            timer[0] += seconds
+            timer[1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        '''
+        Context manager that adds the duration of its block to a timer.
+        '''
+        start = _clock()
+        try:
+            yield
+        finally:
+            self.add_time(name, _clock() - start)
+
+    def count(self, name, n=1):
+        '''
+        Increase a counter.
+        '''
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        '''
+        Return a copy of the current metrics.
+
+        The copy can be passed to ``merge``.
+        '''
+        return ({name: list(timer) for name, timer in self.timers.iteritems()},
+                dict(self.counters))
+
+    def merge(self, snapshot):
+        '''
+        Add the metrics from a snapshot, for example one taken in a
+        worker process.
+        '''
+        timers, counters = snapshot
+        for name, (seconds, calls) in timers.iteritems():
+            timer = self.timers.setdefault(name, [0, 0])
+            timer[0] += seconds
+            timer[1] += calls
+        for name, n in counters.iteritems():
+            self.count(name, n)
+
+    def report(self):
+        '''
+        Return the metrics as a dict that can be serialized to JSON.
+        '''
+        return {
+            'version': __version__,
+            'timers': {name: {'seconds': seconds, 'calls': calls}
+                       for name, (seconds, calls) in self.timers.iteritems()},
+            'counters': dict(self.counters),
+        }
+
+
+metrics = Metrics()
+
+
+def _main_document_part_name(archive):
+    '''
+    Find the name of the main document part in a ``.docx`` archive.
+
+    The name is looked up from the package relationships. Falls back to
+    the usual ``word/document.xml`` if the relationships cannot be read.
+    '''
+    try:
+        rels = etree.fromstring(archive.read(_PACKAGE_RELS))
+    except (KeyError, etree.XMLSyntaxError):
+        return 'word/document.xml'
+    for rel in rels.iterchildren('{%s}Relationship' % _PR_NS):
+        if rel.get('Type') == _OFFICE_DOCUMENT_REL_TYPE:
+            return posixpath.normpath(rel.get('Target')).lstrip('/')
+    return 'word/document.xml'
+
+
+class _MappedFile(object):
+    '''
+    Read-only file-like object for a memory-mapped file.
+
+    Unlike ``mmap.mmap`` itself, ``read`` can be called without a size,
+    as expected by ``zipfile``.
+    '''
+    def __init__(self, f):
+        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.seek = self._map.seek
+        self.tell = self._map.tell
+        self.close = self._map.close
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._map) - self._map.tell()
+        return self._map.read(size)
+
+
+@contextlib.contextmanager
+def _open_docx(filename):
+    '''
+    Context manager that opens a ``.docx`` archive.
+
+    ``filename`` is a filename or a file-like object. Files are mapped
+    into memory instead of being read via buffered I/O. The compressed
+    data is then read directly from the operating system's page cache,
+    which is shared by all processes that read the same file.
 
-    for child in parent_elm.iterchildren():
-        if isinstance(child, CT_P):
-            yield Paragraph(child, parent)
-        elif isinstance(child, CT_Tbl):
-            yield WordTable(child, parent)
+    Returns a ``zipfile.ZipFile`` instance.
+    '''
+    if not isinstance(filename, basestring):
+        with zipfile.ZipFile(filename) as archive:
+            yield archive
+        return
+    with io.open(filename, 'rb') as f:
+        try:
+            data = _MappedFile(f)
+        except (ValueError, mmap.error):
+            # Empty files and files that do not support mapping
+            data = f
+        try:
+            with zipfile.ZipFile(data) as archive:
+                yield archive
+        finally:
+            if data is not f:
+                data.close()
+
+
+def iter_docx_blocks(filename):
+    '''
+    Stream the paragraphs and tables of a Word file in document order.
+
+    In contrast to loading the file via ``docx.Document``, the main
+    document part is parsed incrementally from the ``.docx`` archive and
+    only a single block is kept in memory at a time. This keeps the
+    memory usage constant even for very large documents.
+
+    Generates the ``w:p`` and ``w:tbl`` elements that are direct
+    children of the document body. Their text can be extracted using
+    ``paragraph_text`` and ``extract_data``. Each element is cleared as
+    soon as the next one is requested, so callers must extract all the
+    information they need from a block before advancing the generator.
+
+    Only the package relationships and the main document part are read
+    from the archive. The main document part is decompressed while it
+    is parsed, so the uncompressed XML is never held in memory as a
+    whole.
+    '''
+    start = _clock()
+    with _open_docx(filename) as archive:
+        part = archive.open(_main_document_part_name(archive))
+        metrics.add_time('zip_open', _clock() - start)
+        try:
+            context = etree.iterparse(part, events=('end',),
+                                      tag=(_W_P, _W_TBL),
+                                      remove_blank_text=True,
+                                      resolve_entities=False)
+            start = _clock()
+            for _, element in context:
+                body = element.getparent()
+                if body is None or body.tag != _W_BODY:
+                    # Paragraphs inside table cells are handled as part
+                    # of their table.
+                    continue
+                metrics.add_time('xml_parse', _clock() - start)
+                yield element
+                start = _clock()
+                element.clear()
+                while element.getprevious() is not None:
+                    del body[0]
+                metrics.add_time('block_iteration', _clock() - start)
+                start = _clock()
+            metrics.add_time('xml_parse', _clock() - start)
+        finally:
+            part.close()
+
+
+# Whitespace that ``clean_string`` has to replace: runs of whitespace and
+# whitespace other than a single space.
+_UNCLEAN_WHITESPACE = re.compile(r'[\t\n\r\f\v]| \s')
+
+_WHITESPACE = re.compile(r'\s+')
+
+_UNICODE_WHITESPACE = re.compile(r'\s+', flags=re.UNICODE)
 
 
 def split(s, maxsplit=None):
@@ -84,7 +381,12 @@ def split(s, maxsplit=None):
     however, you can set the maximum number of splits via ``maxsplit``
     while not having to pass an explicit separator.
     '''
-    return re.split(r'\s+', s.strip(), maxsplit=maxsplit, flags=re.UNICODE)
+    s = s.strip()
+    if isinstance(s, unicode):
+        # ``unicode.split`` splits at the same whitespace as the regular
+        # expression but returns an empty list for an empty string.
+        return s.split(None, maxsplit or -1) or ['']
+    return _UNICODE_WHITESPACE.split(s, maxsplit=maxsplit or 0)
 
 
 def clean_string(s):
@@ -94,7 +396,10 @@ def clean_string(s):
     Replaces all adjacent whitespace by a single space and strips
     leading and trailing whitespace.
     '''
-    return re.sub(r'\s+', ' ', s.strip())
+    s = s.strip()
+    if _UNCLEAN_WHITESPACE.search(s) is None:
+        return s
+    return _WHITESPACE.sub(' ', s)
 
 
 def parse_amount(s):
@@ -108,6 +413,87 @@ def parse_amount(s):
     return Decimal('.'.join(parts))
 
 
+# Matches a single amount string (see ``parse_amount``) terminated by a
+# NUL character, which cannot occur in the text of a Word document.
+# Strings with unusual content (anything after the digits) end up in the
+# last group and are handled by ``parse_amount``.
+_AMOUNTS_RE = re.compile(r'([+-]?)([0-9.]*)(?:,([0-9]*))?([^\x00]*)\x00')
+
+
+def _parse_amounts_fast(strings):
+    '''
+    Parse German amount strings in a single pass.
+
+    Like ``parse_amounts``, but entries for strings that cannot be
+    handled by the fast path are ``None``.
+    '''
+    if not strings:
+        return []
+    matches = _AMOUNTS_RE.findall('\x00'.join(strings) + '\x00')
+    if len(matches) != len(strings):
+        # Strings contain NUL characters
+        return [None] * len(strings)
+    amounts = []
+    append = amounts.append
+    for sign, int_part, fraction, rest in matches:
+        if rest:
+            append(None)
+            continue
+        # Same coefficient and exponent as ``Decimal`` computes for the
+        # string created by ``parse_amount``.
+        coefficient = int(int_part.replace('.', '') +
+                          fraction[:2].ljust(2, '0'))
+        if _dec_from_triple:
+            append(_dec_from_triple(1 if sign == '-' else 0,
+                                    str(coefficient), -2))
+        else:
+            append(Decimal('{}{}E-2'.format('-' if sign == '-' else '',
+                                            coefficient)))
+    return amounts
+
+
+def _amount_cents(amount):
+    '''
+    Convert an amount with two decimal places to integer cents.
+    '''
+    if _dec_from_triple and amount._exp == -2 and not amount._is_special:
+        # Avoid the slow arithmetic of the pure Python ``decimal``
+        cents = int(amount._int)
+        return -cents if amount._sign else cents
+    return int(amount.scaleb(2))
+
+
+def parse_amounts(strings):
+    '''
+    Parse a list of German amount strings.
+
+    Returns the same list of ``Decimal`` instances as calling
+    ``parse_amount`` for each string, but is much faster for large
+    lists: The strings are matched using a single pass of a compiled
+    regular expression and the amounts are created directly from their
+    sign, digits and exponent instead of being parsed again by
+    ``Decimal``.
+    '''
+    amounts = _parse_amounts_fast(strings)
+    for i, amount in enumerate(amounts):
+        if amount is None:
+            amounts[i] = parse_amount(strings[i])
+    return amounts
+
+
+# Maximum number of header layouts that are cached by ``table_from_data``
+# and ``Table._parse_headers``. A document only has a handful of
+# different layouts, the limit protects against unusual documents.
+_HEADER_CACHE_SIZE = 1024
+
+
+def _cache_header(cache, key, value):
+    if len(cache) >= _HEADER_CACHE_SIZE:
+        cache.clear()
+    cache[key] = value
+    return value
+
+
 def parse_int(s):
     '''
     Parse an int from a string, returns ``None`` for empty strings.
@@ -117,6 +503,27 @@ def parse_int(s):
     return int(s)
 
 
+class Value(collections.namedtuple('Value', ['year', 'type', 'amount'])):
+    '''
+    The amount of a position for a year and a type (for example
+    ``Plan``).
+
+    The fields are in the order of the value columns of the exported
+    datasets. Like in a dict, they can also be accessed by name, for
+    example ``value['amount']``.
+    '''
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+
+# Creates a ``Value`` from a tuple without the overhead of ``__new__``
+_new_value = functools.partial(tuple.__new__, Value)
+
+
 class Table(list):
     '''
     Base class for extracted tables.
@@ -151,14 +558,30 @@ class Table(list):
       header and uses them to set ``self._value_columns`` to a dict that
       maps column indices to 2-tuples containing the column's type and
       year.
+
+    The values of a row are stored as a list of ``Value`` instances in
+    its record.
+
+    The tables of a document share only a few different headers, so
+    the result of ``_parse_headers`` is cached per table class and
+    header (see ``_ColumnPlan``).
+
+    Subclasses for a table layout set ``header_signature`` and are
+    registered using ``register_layout``, so that ``table_from_data``
+    can identify the tables that have the layout.
     '''
+    # Maps column indices to the keywords that identify the layout in
+    # the first row of the header, see ``register_layout``
+    header_signature = None
+
     def __init__(self, data, teilhaushalt=None, produktbereich=None,
                  produktgruppe=None):
         super(Table, self).__init__()
         self.teilhaushalt = teilhaushalt
         self.produktbereich = produktbereich
         self.produktgruppe = produktgruppe
-        self._parse(data)
+        with metrics.timer('parse'):
+            self._parse(data)
 
     def _parse_meta_headers(self, header):
         raise NotImplementedError('Must be implemented in subclass')
@@ -177,30 +600,76 @@ class Table(list):
                 self._value_columns[i] = (clean_string(parts[0]), year)
 
     def _parse_headers(self, header):
-        self._parse_meta_headers(header)
-        self._parse_value_headers(header)
+        key = (type(self), tuple(header))
+        plan = _column_plans.get(key)
+        if plan is None:
+            self._parse_meta_headers(header)
+            self._parse_value_headers(header)
+            plan = _cache_header(_column_plans, key, _ColumnPlan(
+                                 self._meta_columns, self._value_columns))
+        else:
+            self._meta_columns = plan.meta_columns
+            self._value_columns = plan.value_columns
+        self._plan = plan
+
+    def _parse_amounts(self, rows):
+        '''
+        Parse the amounts in the value columns of several rows at once.
+
+        Returns a list which contains a list of amounts for each row.
+        The amounts are in the order of ``self._value_columns``. An
+        amount is ``None`` if it could not be parsed by the fast path of
+        ``parse_amounts``, in that case ``_parse_row`` falls back to
+        ``parse_amount``.
+        '''
+        indices = self._plan.value_indices
+        if not indices:
+            return [[] for _ in rows]
+        num = len(indices)
+        width = self._plan.width
+        amounts = _parse_amounts_fast([row[i] for row in rows
+                                      if len(row) >= width
+                                      for i in indices])
+        result = []
+        pos = 0
+        for row in rows:
+            if len(row) >= width:
+                result.append(amounts[pos:pos + num])
+                pos += num
+            else:
+                result.append([None] * num)
+        return result
 
-    def _parse_row(self, row):
+    def _parse_row(self, row, amounts=None):
         '''
         Parse a single, non-header row of the table.
 
+        ``amounts`` is an optional list of the row's amounts as returned
+        by ``_parse_amounts``.
+
         Returns a dict that contains the row's entries for the meta-
         columns (as given by ``self._meta_columns``) and a ``values``
-        entry which contains a list of dicts representing the entries
-        in the value columns (as given by ``self._value_columns``).
+        entry which contains a list of ``Value`` instances representing
+        the entries in the value columns (as given by
+        ``self._value_columns``).
 
         May return ``None`` if the row should be ignored.
         '''
+        plan = self._plan
         values = []
         record = {'values': values}
-        for i, (key, transform) in self._meta_columns.iteritems():
+        for i, key, transform in plan.meta_items:
             value = row[i]
             if transform:
                 value = transform(value)
             record[key] = value
-        for i, (type, year) in self._value_columns.iteritems():
-            values.append({'type': type, 'year': year,
-                           'amount': parse_amount(row[i])})
+        if amounts is None:
+            amounts = _parse_amounts_fast([row[i]
+                                          for i in plan.value_indices])
+        for (i, type, year), amount in zip(plan.value_items, amounts):
+            if amount is None:
+                amount = parse_amount(row[i])
+            values.append(_new_value((year, type, amount)))
         if record['number'] and not record['sign']:
             log.debug('Row {} has a number but no sign, ignoring it.'.format(
                       row))
@@ -208,22 +677,29 @@ class Table(list):
         return record
 
     def _parse(self, data):
+        # Checked once per table so that the debug messages for the
+        # individual rows are only formatted if they are logged.
+        debug = log.isEnabledFor(logging.DEBUG)
         log.debug('Parsing headers')
         self._parse_headers(data[0])
-        log.debug('Meta columns: {}'.format(self._meta_columns))
-        log.debug('Value columns: {}'.format(self._value_columns))
+        if debug:
+            log.debug('Meta columns: {}'.format(self._meta_columns))
+            log.debug('Value columns: {}'.format(self._value_columns))
         position = None
-        for row in data[2:]:  # The second row is part of the header
-            log.debug('Parsing row {}'.format(row))
+        rows = data[2:]  # The second row is part of the header
+        for row, amounts in zip(rows, self._parse_amounts(rows)):
+            if debug:
+                log.debug('Parsing row {}'.format(row))
             if not self._does_row_have_values(row):
                 log.debug('Row has now values, ignoring it')
                 position = None
                 continue
-            record = self._parse_row(row)
+            record = self._parse_row(row, amounts)
             if record is None:
                 position = None
                 continue
-            log.debug('Record: {}'.format(record))
+            if debug:
+                log.debug('Record: {}'.format(record))
             if record['number']:
                 # Row starts a new position
                 record['children'] = []
@@ -242,7 +718,7 @@ class Table(list):
         '''
         Check if a row has entries in the value columns.
         '''
-        for i in self._value_columns:
+        for i in self._plan.value_indices:
             if row[i]:
                 return True
         return False
@@ -257,15 +733,68 @@ class Table(list):
         '''
         return iter(self)
 
-    def dump_csv(self, writer, additional_columns=None, meta_columns=None,
-                 include_summaries=False):
-        if additional_columns is None:
-            additional_columns = []
+    def _summary_groups(self):
+        '''
+        Return the lists of positions that are checked by
+        ``check_summaries``.
+        '''
+        return [self]
+
+    def check_summaries(self):
+        '''
+        Check the amounts of the summary positions (sign ``=``).
+
+        A summary position must contain the sum of the positions (sign
+        ``+`` or ``-``) since the previous summary position or the sum
+        of all previous positions. Since the amounts of expenses are
+        negative, no further sign handling is necessary. The sums are
+        computed in integer cents for all value columns at once.
+
+        Returns a list of 3-tuples, each of which contains a summary
+        position, the index of the mismatching value in its ``values``
+        and the expected amount.
+        '''
+        mismatches = []
+        for positions in self._summary_groups():
+            block = total = None
+            for position in positions:
+                amounts = [_amount_cents(value.amount)
+                           for value in position['values']]
+                if position['sign'] != '=':
+                    if block is None:
+                        block = amounts
+                    else:
+                        block = map(operator.add, block, amounts)
+                    if total is None:
+                        total = amounts
+                    else:
+                        total = map(operator.add, total, amounts)
+                    continue
+                if total is not None and amounts != block and \
+                        amounts != total:
+                    expected = block or total
+                    for i, (amount, sum) in enumerate(zip(amounts,
+                                                          expected)):
+                        if amount != sum:
+                            mismatches.append((position, i,
+                                               Decimal(sum).scaleb(-2)))
+                block = None
+        return mismatches
+
+    def _flat_records(self, meta_columns=None, include_summaries=False):
+        '''
+        Generate the records of the table in the flat form of the
+        exported datasets.
+
+        Generates 2-tuples containing the list of the values of the
+        ``meta_columns`` and the list of ``Value`` instances of a
+        record.
+        '''
         if meta_columns is None:
             meta_columns = [c[0] for c in self._meta_columns.itervalues()]
 
-        def dump_record(record, parent=None):
-            fields = list(additional_columns)
+        def flatten(record, parent=None):
+            fields = []
             for key in meta_columns:
                 value = record.get(key)
                 if (not value) and (not include_summaries) and parent:
@@ -274,22 +803,136 @@ class Table(list):
                 elif (key == 'title') and (not include_summaries) and parent:
                     value = '{}: {}'.format(parent['title'], value)
                 fields.append(value)
-            for value in record['values']:
-                writer.writerow(fields + [value['year'], value['type'], value['amount']])
+            return fields, record['values']
 
         for record in self._csv_records():
             if (record['sign'] == '=') and not include_summaries:
                 continue
             if record['children']:
                 if include_summaries:
-                    dump_record(record)
+                    yield flatten(record)
                 for child in record['children']:
-                    dump_record(child, record)
+                    yield flatten(child, record)
             else:
-                dump_record(record)
+                yield flatten(record)
+
+    def dump_csv(self, writer, additional_columns=None, meta_columns=None,
+                 include_summaries=False):
+        if additional_columns is None:
+            additional_columns = []
+        records = ((tuple(additional_columns + fields), values)
+                   for fields, values in self._flat_records(
+                       meta_columns, include_summaries))
+        # The fields of a ``Value`` are in the order of the columns
+        writer.writerows(fields + value for fields, values in records
+                         for value in values)
+
+    def compact(self):
+        '''
+        Return a compact copy of the table.
+
+        The copy stores the table's positions in column arrays instead
+        of nested lists and dicts, which needs a lot less memory. The
+        positions are reconstructed on demand when the copy is accessed
+        like a list. The copy is an instance of a subclass of the
+        table's class and is read-only.
+        '''
+        table = list.__new__(_compact_class(type(self)))
+        table.__dict__.update(self.__dict__)
+        table._columns = _Columns(self)
+        return table
+
+
+class _ColumnPlan(object):
+    '''
+    The column layout of a table header.
+
+    Contains the ``_meta_columns`` and ``_value_columns`` of a table
+    (see ``Table``) along with the lists of columns that are used by
+    ``Table._parse_row``, so that these do not have to be recomputed for
+    each table and row.
+    '''
+    def __init__(self, meta_columns, value_columns):
+        self.meta_columns = meta_columns
+        self.value_columns = value_columns
+        self.meta_items = [(i, key, transform) for i, (key, transform)
+                           in meta_columns.iteritems()]
+        self.value_items = [(i, type, year) for i, (type, year)
+                            in value_columns.iteritems()]
+        self.value_indices = [item[0] for item in self.value_items]
+        self.width = max(self.value_indices) + 1 if self.value_indices else 0
+
+
+# Column plans by table class and header, see ``Table._parse_headers``
+_column_plans = {}
+
+
+# Registered ``Table`` subclasses in the order of their registration
+_layouts = []
+
+# Table classes by header, see ``table_from_data``
+_table_classes = {}
+
+# Keyword index of the registered layouts: Maps column indices to a
+# 2-tuple containing a regular expression that finds the keywords of
+# the column and a dict that maps each keyword to the layouts that
+# contain it.
+_layout_index = {}
+
+
+def register_layout(table_class):
+    '''
+    Register a ``Table`` subclass for a table layout.
+
+    The class's ``header_signature`` is a dict that maps column indices
+    to keywords. A table has the layout if each of these columns of the
+    first row of its header contains the column's keyword (ignoring
+    case). If a table has several registered layouts then the layout
+    that was registered first is used.
+
+    A keyword must not be the beginning of a different keyword for the
+    same column, since the keyword index cannot find both of them at
+    the same position. A ``ValueError`` is raised in that case.
+
+    Returns ``table_class``, so that this can be used as a class
+    decorator.
+    '''
+    if table_class in _layouts:
+        return table_class
+    signature = table_class.header_signature
+    if not signature:
+        raise ValueError('{} has no header signature'.format(
+                         table_class.__name__))
+    signature = {column: keyword.lower() for column, keyword
+                 in signature.iteritems()}
+    keywords = collections.defaultdict(dict)
+    for layout in _layouts:
+        for column, keyword in layout.header_signature.iteritems():
+            keyword = keyword.lower()
+            own = signature.get(column)
+            if own and own != keyword and (own.startswith(keyword) or
+                                           keyword.startswith(own)):
+                raise ValueError(('Keyword "{}" of {} conflicts with ' +
+                                 'keyword "{}" of {}').format(
+                                 own, table_class.__name__, keyword,
+                                 layout.__name__))
+            keywords[column].setdefault(keyword, []).append(layout)
+    _layouts.append(table_class)
+    for column, keyword in signature.iteritems():
+        keywords[column].setdefault(keyword, []).append(table_class)
+    _layout_index.clear()
+    for column, layouts in keywords.iteritems():
+        # The lookahead finds overlapping occurrences, too
+        pattern = re.compile('(?=({}))'.format('|'.join(
+                             re.escape(keyword) for keyword in layouts)),
+                             flags=re.UNICODE)
+        _layout_index[column] = (pattern, layouts)
+    _table_classes.clear()
+    return table_class
 
 
 class GesamtergebnishaushaltTable(Table):
+    header_signature = {2: 'Gesamtergebnishaushalt'}
 
     def _parse_meta_headers(self, header):
         self._meta_columns = {
@@ -300,6 +943,7 @@ class GesamtergebnishaushaltTable(Table):
 
 
 class TeilergebnishaushaltTable(Table):
+    header_signature = {3: 'Teilergebnishaushalt'}
 
     def _parse_meta_headers(self, header):
         self._meta_columns = {
@@ -309,8 +953,9 @@ class TeilergebnishaushaltTable(Table):
             3: ('title', None),
         }
 
-    def _parse_row(self, row):
-        record = super(TeilergebnishaushaltTable, self)._parse_row(row)
+    def _parse_row(self, row, amounts=None):
+        record = super(TeilergebnishaushaltTable, self)._parse_row(row,
+                                                                   amounts)
         if record is None:
             return
         if record['sign'] and not record['kontogruppe']:
@@ -321,6 +966,7 @@ class TeilergebnishaushaltTable(Table):
 
 
 class FinanzhaushaltTable(Table):
+    header_signature = {2: 'Finanzhaushalt'}
 
     def _parse_meta_headers(self, header):
         self._meta_columns = {
@@ -331,6 +977,7 @@ class FinanzhaushaltTable(Table):
 
 
 class InvestitionsuebersichtTable(Table):
+    header_signature = {2: 'Investitionsübersicht'}
 
     def _parse_meta_headers(self, header):
         self._meta_columns = {
@@ -346,7 +993,7 @@ class InvestitionsuebersichtTable(Table):
     def _parse_body(self, rows):
         project = None
         position = None
-        for row in rows:
+        for row, amounts in zip(rows, self._parse_amounts(rows)):
             if len(set(row)) == 1:
                 # Row consisting of a single merged cell containing the
                 # project ID and name.
@@ -359,7 +1006,7 @@ class InvestitionsuebersichtTable(Table):
                 self.append(project)
             else:
                 # Standard row
-                record = self._parse_row(row)
+                record = self._parse_row(row, amounts)
                 if record['number']:
                     assert record['sign']
                     record['children'] = []
@@ -370,6 +1017,9 @@ class InvestitionsuebersichtTable(Table):
                     assert not record.pop('kontogruppe', None)
                     position['children'].append(record)
 
+    def _summary_groups(self):
+        return [project['positions'] for project in self]
+
     def _csv_records(self):
         for project in self:
             for position in project['positions']:
@@ -379,17 +1029,413 @@ class InvestitionsuebersichtTable(Table):
                 yield record
 
 
+# The built-in layouts. If a header matches several of them then the
+# first one in this list is used.
+register_layout(FinanzhaushaltTable)
+register_layout(InvestitionsuebersichtTable)
+register_layout(TeilergebnishaushaltTable)
+register_layout(GesamtergebnishaushaltTable)
+
+
+# Sentinels for missing values in integer columns of compact tables
+_INT_NONE = -2 ** 31
+_INT_MISSING = -2 ** 31 + 1
+
+try:
+    array(b'q')
+    _INT64_TYPECODE = b'q'
+except ValueError:
+    # Python 2 has no "long long" arrays, "long" is 64 bit on most
+    # platforms.
+    _INT64_TYPECODE = b'l'
+
+_MISSING = object()
+
+# Keys of the nested lists in table records
+_CHILD_LIST_KEYS = ('children', 'positions')
+
+
+class _Columns(object):
+    '''
+    Column-oriented storage of the records of a table.
+
+    The records (and their nested children) are stored in pre-order.
+    Each record is described by a "shape" (its scalar keys, the key of
+    its list of children, and whether it has values). The scalar fields
+    are stored in one column per key: Integer fields in integer arrays,
+    all other fields as indices into a pool of interned values. Value
+    types and years are stored the same way and amounts are stored as
+    integer cents.
+    '''
+    def __init__(self, items):
+        self._pool = []
+        self._pool_index = {}
+        self._shapes = []
+        shape_index = {}
+        self._shape = array(b'i')
+        self._child_count = array(b'i')
+        self._value_count = array(b'i')
+        self._top_nodes = array(b'i')
+        self._top_values = array(_INT64_TYPECODE)
+        self._value_type = array(b'i')
+        self._value_year = array(b'l')
+        self._value_amount = array(_INT64_TYPECODE)
+        self._negative_zeros = set()
+        fields = {}
+        num_values = [0]
+
+        def add_node(node):
+            scalar_keys = []
+            child_key = None
+            values = None
+            for key, value in node.iteritems():
+                if key == 'values':
+                    values = value
+                elif key in _CHILD_LIST_KEYS:
+                    child_key = key
+                else:
+                    scalar_keys.append(key)
+            scalar_keys.sort()
+            shape = (tuple(scalar_keys), child_key, values is not None)
+            if shape not in shape_index:
+                shape_index[shape] = len(self._shapes)
+                self._shapes.append(shape)
+            index = len(self._shape)
+            self._shape.append(shape_index[shape])
+            for key in scalar_keys:
+                column = fields.get(key)
+                if column is None:
+                    column = fields[key] = [_MISSING] * index
+                column.append(node[key])
+            for key, column in fields.iteritems():
+                if len(column) == index:
+                    column.append(_MISSING)
+            self._value_count.append(len(values) if values else 0)
+            for value in values or ():
+                if type(value) is not Value:
+                    raise ValueError('Unsupported value {!r}'.format(value))
+                self._value_type.append(self._intern(value.type))
+                self._value_year.append(_INT_NONE if value.year is None
+                                        else value.year)
+                amount = value.amount
+                if amount.as_tuple().exponent != -2:
+                    raise ValueError('Unsupported amount {!r}'.format(
+                                     amount))
+                cents = int(amount.scaleb(2))
+                if not cents and amount.is_signed():
+                    self._negative_zeros.add(num_values[0])
+                self._value_amount.append(cents)
+                num_values[0] += 1
+            children = node[child_key] if child_key else ()
+            self._child_count.append(len(children))
+            for child in children:
+                add_node(child)
+
+        for item in items:
+            self._top_nodes.append(len(self._shape))
+            self._top_values.append(num_values[0])
+            add_node(item)
+        self._fields = {}
+        for key, column in fields.iteritems():
+            self._fields[key] = self._pack_column(column)
+        del self._pool_index
+
+    def _intern(self, value):
+        try:
+            return self._pool_index[value]
+        except KeyError:
+            index = self._pool_index[value] = len(self._pool)
+            self._pool.append(value)
+            return index
+
+    def _pack_column(self, column):
+        '''
+        Convert a list of field values into an array.
+
+        Returns a 2-tuple containing a flag that indicates whether the
+        array contains integers (``True``) or indices into the pool
+        (``False``) and the array itself.
+        '''
+        if all((v is _MISSING) or (v is None) or
+               (type(v) in (int, long) and _INT_MISSING < v < 2 ** 31)
+               for v in column):
+            return True, array(b'l', (_INT_MISSING if v is _MISSING else
+                                      _INT_NONE if v is None else v
+                                      for v in column))
+        return False, array(b'i', (-1 if v is _MISSING else self._intern(v)
+                                   for v in column))
+
+    def __len__(self):
+        return len(self._top_nodes)
+
+    def _amount(self, index):
+        if index in self._negative_zeros:
+            return Decimal('-0.00')
+        return Decimal(self._value_amount[index]).scaleb(-2)
+
+    def _node(self, node, value_index):
+        '''
+        Reconstruct a record from the columns.
+
+        Returns a 3-tuple containing the record and the indices of the
+        next node and the next value.
+        '''
+        scalar_keys, child_key, has_values = self._shapes[self._shape[node]]
+        record = {}
+        for key in scalar_keys:
+            is_int, column = self._fields[key]
+            value = column[node]
+            if is_int:
+                record[key] = None if value == _INT_NONE else value
+            else:
+                record[key] = self._pool[value]
+        if has_values:
+            values = record['values'] = []
+            pool = self._pool
+            for i in range(value_index,
+                           value_index + self._value_count[node]):
+                year = self._value_year[i]
+                values.append(_new_value((
+                    None if year == _INT_NONE else year,
+                    pool[self._value_type[i]],
+                    self._amount(i),
+                )))
+        value_index += self._value_count[node]
+        child_count = self._child_count[node]
+        node += 1
+        if child_key:
+            children = record[child_key] = []
+            for _ in range(child_count):
+                child, node, value_index = self._node(node, value_index)
+                children.append(child)
+        return record, node, value_index
+
+    def item(self, index):
+        '''
+        Reconstruct the top-level record with the given index.
+        '''
+        return self._node(self._top_nodes[index], self._top_values[index])[0]
+
+
+class _CompactTableMixin(object):
+    '''
+    Mixin for tables whose records are stored in a ``_Columns`` instance.
+
+    Tables with this mixin are read-only. Their records are
+    reconstructed as dicts on demand, so that existing code (for
+    example ``Table.dump_csv``) works without changes.
+
+    The storage of the underlying ``list`` is empty, so every
+    non-mutating list operation is implemented here in terms of
+    ``__iter__``. Operations that combine a table with another list
+    return a plain ``list``.
+    '''
+    def __len__(self):
+        return len(self._columns)
+
+    def __iter__(self):
+        columns = self._columns
+        for i in range(len(columns)):
+            yield columns.item(i)
+
+    def __reversed__(self):
+        columns = self._columns
+        for i in reversed(range(len(columns))):
+            yield columns.item(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._columns.item(i)
+                    for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Table index out of range')
+        return self._columns.item(index)
+
+    def __getslice__(self, i, j):
+        return self[max(0, i):max(0, j):]
+
+    def __contains__(self, item):
+        return any(record == item for record in self)
+
+    def count(self, item):
+        return sum(1 for record in self if record == item)
+
+    def index(self, item, *args):
+        return list(self).index(item, *args)
+
+    def __add__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        if not isinstance(other, list):
+            return NotImplemented
+        return list(other) + list(self)
+
+    def __mul__(self, n):
+        return list(self) * n
+
+    __rmul__ = __mul__
+
+    def _compare(self, other, op):
+        if not isinstance(other, list):
+            return NotImplemented
+        return op(list(self), list(other))
+
+    def __eq__(self, other):
+        return self._compare(other, operator.eq)
+
+    def __ne__(self, other):
+        return self._compare(other, operator.ne)
+
+    def __lt__(self, other):
+        return self._compare(other, operator.lt)
+
+    def __le__(self, other):
+        return self._compare(other, operator.le)
+
+    def __gt__(self, other):
+        return self._compare(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._compare(other, operator.ge)
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        return (_restore_compact_table, (self._table_class, self.__dict__))
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('Compact tables are read-only')
+
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    __setslice__ = __delslice__ = _read_only
+
+    def compact(self):
+        return self
+
+
+_compact_classes = {}
+
+
+def _compact_class(table_class):
+    '''
+    Return the compact variant of a ``Table`` subclass.
+
+    The compact variant is a subclass of ``table_class``, so that
+    ``isinstance`` checks work for compact tables, too.
+    '''
+    try:
+        return _compact_classes[table_class]
+    except KeyError:
+        cls = type(str('Compact' + table_class.__name__),
+                   (_CompactTableMixin, table_class),
+                   {'_table_class': table_class})
+        _compact_classes[table_class] = cls
+        return cls
+
+
+def _restore_compact_table(table_class, state):
+    table = list.__new__(_compact_class(table_class))
+    table.__dict__.update(state)
+    return table
+
+
+def paragraph_text(p):
+    '''
+    Extract the text of a ``w:p`` element.
+
+    Returns the same text as python-docx's ``Paragraph.text``.
+    '''
+    parts = []
+    for node in _xpath.paragraph_text(p):
+        text = _RUN_CONTENT_TEXT.get(node.tag)
+        if text is None:
+            text = node.text or ''
+        parts.append(text)
+    return ''.join(parts)
+
+
+def _cell_text(tc):
+    '''
+    Extract the text of a ``w:tc`` element.
+
+    Returns the same text as python-docx's ``_Cell.text``.
+    '''
+    parts = []
+    for node in _xpath.cell_text(tc):
+        if node.tag == _W_P:
+            if parts:
+                parts.append('\n')
+            continue
+        text = _RUN_CONTENT_TEXT.get(node.tag)
+        if text is None:
+            text = node.text or ''
+        parts.append(text)
+    return ''.join(parts)
+
+
 def extract_data(table):
     '''
     Extract the data from a Word table.
 
+    ``table`` is either a python-docx ``Table`` or a ``w:tbl`` element.
+
     Returns a list of rows, each of which is a list of cell values as
-    strings.
+    strings. Cells spanning several grid columns (``w:gridSpan``) or
+    rows (``w:vMerge``) are repeated, like in python-docx's
+    ``_Row.cells``. In contrast to using ``_Row.cells``, however, the
+    layout grid is resolved only once for the whole table and the text
+    is extracted directly from the XML.
+    '''
+    tbl = getattr(table, '_tbl', table)
+    col_count = len(_xpath.grid_cols(tbl))
+    rows = _xpath.rows(tbl)
+    cells = _grid_cells(rows, col_count)
+    return [cells[i * col_count:(i + 1) * col_count]
+            for i in range(len(rows))]
+
+
+def _extract_header(tbl):
+    '''
+    Extract the first row of a ``w:tbl`` element.
+
+    Returns the same row as ``extract_data(tbl)[0]`` without extracting
+    the rest of the table.
     '''
-    data = []
-    for row in table.rows:
-        data.append([cell.text.strip() for cell in row.cells])
-    return data
+    col_count = len(_xpath.grid_cols(tbl))
+    tr = tbl.find('w:tr', _W_NSMAP)
+    cells = _grid_cells([] if tr is None else [tr], col_count)
+    if len(cells) < col_count:
+        # The cells of the following rows are shifted into the first row
+        return extract_data(tbl)[0]
+    return cells[:col_count]
+
+
+def _grid_cells(rows, col_count):
+    '''
+    Extract the cell texts of ``w:tr`` elements in grid order.
+
+    See ``extract_data``.
+    '''
+    cells = []
+    for tr in rows:
+        for tc in _xpath.cells(tr):
+            span = _xpath.grid_span(tc)
+            span = int(span[0]) if span else 1
+            vmerge = _xpath.vmerge(tc)
+            if vmerge and vmerge[0].get(_W_VAL, 'continue') == 'continue':
+                for _ in range(span):
+                    cells.append(cells[-col_count])
+            else:
+                text = _cell_text(tc).strip()
+                cells.extend([text] * span)
+    return cells
 
 
 class BudgetExportException(Exception):
@@ -399,20 +1445,48 @@ class UnknownTableTypeException(BudgetExportException):
     pass
 
 
+def _table_class_from_header(header):
+    '''
+    Determine the ``Table`` subclass for a table header.
+
+    Looks up the keywords in the header's cells in the index of the
+    registered layouts (see ``register_layout``), so that the time does
+    not depend on the number of layouts.
+
+    Returns ``None`` if the table type is unknown.
+    '''
+    matches = []
+    for column, (pattern, layouts) in _layout_index.iteritems():
+        if column < len(header):
+            for keyword in set(pattern.findall(header[column].lower())):
+                matches.extend(layouts[keyword])
+    for layout in sorted(set(matches), key=_layouts.index):
+        # A layout matches if all of its keywords have been found
+        if matches.count(layout) == len(layout.header_signature):
+            return layout
+
+
 def table_from_data(data):
     '''
     Factory that converts raw table data to a ``Table`` instance.
     '''
-    if 'finanzhaushalt' in data[0][2].lower():
-        return FinanzhaushaltTable(data)
-    elif 'investitionsübersicht' in data[0][2].lower():
-        return InvestitionsuebersichtTable(data)
-    elif 'teilergebnishaushalt' in data[0][3].lower():
-        return TeilergebnishaushaltTable(data)
-    elif 'gesamtergebnishaushalt' in data[0][2].lower():
-        return GesamtergebnishaushaltTable(data)
-    else:
+    table_class = _table_class(data[0])
+    if table_class is None:
         raise UnknownTableTypeException('Unknown table type.')
+    return table_class(data)
+
+
+def _table_class(header):
+    '''
+    Return the ``Table`` subclass for a table header or ``None`` if the
+    table type is unknown.
+    '''
+    header = tuple(header)
+    try:
+        return _table_classes[header]
+    except KeyError:
+        return _cache_header(_table_classes, header,
+                             _table_class_from_header(header))
 
 
 class _HeadingState(object):
@@ -445,7 +1519,7 @@ class _HeadingState(object):
         text = text.strip()
         if not text:
             return
-        log.debug('Heading "{}"'.format(text))
+        log.debug('Heading "%s"', text)
         self.text = text
         parts = split(text, 1)
         if len(parts) != 2:
@@ -484,152 +1558,2093 @@ class _HeadingState(object):
             self.produktgruppe = self.produktbereich['produktgruppen'].setdefault(
                     id, {'id': id, 'title': title})
 
+    def context(self):
+        '''
+        Return the current heading context for a table.
 
-if __name__ == '__main__':
-    import argparse
-    import io
-    import sys
+        Returns a 4-tuple containing the IDs of the current Teilhaushalt,
+        Produktbereich and Produktgruppe (each of which may be ``None``)
+        and the text of the last heading.
+        '''
+        return tuple([x['id'] if x else None for x in (
+                      self.teilhaushalt, self.produktbereich,
+                      self.produktgruppe)] + [self.text])
 
-    parser = argparse.ArgumentParser(description='Export budget data to CSV.')
-    parser.add_argument('filenames', metavar='DOCX', nargs='+',
-                        help='Input files (Word .docx format)')
-    parser.add_argument('--verbose', '-v', action='count', help='Increase ' +
-                        'verbosity (can be specified two times)')
-    args = parser.parse_args()
+    def merge_teilhaushalte(self, teilhaushalte):
+        '''
+        Merge Teilhaushalte that were registered by another instance.
+
+        ``teilhaushalte`` is the ``teilhaushalte`` attribute of another
+        ``_HeadingState``. Like in ``register_heading``, entries that
+        already exist are kept. Merging the Teilhaushalte of separate
+        instances in document order therefore gives the same result as
+        registering all headings with a single instance.
+        '''
+        for thh in teilhaushalte.itervalues():
+            own_thh = self.teilhaushalte.setdefault(
+                    thh['id'], {'id': thh['id'], 'title': thh['title'],
+                                'produktbereiche': {}})
+            for pb in thh['produktbereiche'].itervalues():
+                own_pb = own_thh['produktbereiche'].setdefault(
+                        pb['id'], {'id': pb['id'], 'title': pb['title'],
+                                   'produktgruppen': {}})
+                for pg in pb['produktgruppen'].itervalues():
+                    own_pb['produktgruppen'].setdefault(pg['id'], dict(pg))
+
+
+class Selection(object):
+    '''
+    Selects the tables that are loaded from the Word files.
+
+    ``kinds`` is a list of dataset names (see ``DATASETS``), only the
+    tables that belong to one of these datasets are selected.
+
+    ``teilhaushalte``, ``produktbereiche`` and ``produktgruppen`` are
+    lists of IDs. Only the tables below one of the given Teilhaushalte,
+    Produktbereiche and Produktgruppen are selected, respectively. Note
+    that tables which are not below a Produktbereich (for example the
+    Gesamtergebnishaushalt or the Teilfinanzhaushalte) are not selected
+    if ``produktbereiche`` is given.
+
+    Criteria that are ``None`` or empty select all tables.
+
+    The selection is checked using the heading context and the first
+    row of a table, so tables that are not selected are skipped before
+    their data is extracted.
+    '''
+    def __init__(self, kinds=None, teilhaushalte=None, produktbereiche=None,
+                 produktgruppen=None):
+        self.kinds = frozenset(kinds or ())
+        unknown = self.kinds.difference(dataset.name for dataset in DATASETS)
+        if unknown:
+            raise ValueError('Unknown dataset(s): {}'.format(
+                             ', '.join(sorted(unknown))))
+        self._ids = [frozenset(ids or ()) for ids in (
+                     teilhaushalte, produktbereiche, produktgruppen)]
+
+    def key(self):
+        '''
+        Return a string that identifies the selection.
+        '''
+        return repr([sorted(self.kinds)] + [sorted(ids) for ids in self._ids])
+
+    def matches_context(self, context):
+        '''
+        Check if the heading context of a table is selected.
+
+        ``context`` is a heading context as returned by
+        ``_HeadingState.context``.
+        '''
+        for ids, id in zip(self._ids, context):
+            if ids and id not in ids:
+                return False
+        return True
+
+    def matches_header(self, header, context):
+        '''
+        Check if a table is selected by its type.
+
+        ``header`` is the first row of the table and ``context`` is its
+        heading context.
+        '''
+        if not self.kinds:
+            return True
+        table_class = _table_class(header)
+        if table_class is None:
+            return False
+        # The dataset filters only need the class and the context
+        table = list.__new__(table_class)
+        table.teilhaushalt, table.produktbereich, table.produktgruppe = \
+            context[:3]
+        # The datasets are looked up here instead of being stored in the
+        # selection, since their filters cannot be pickled for the worker
+        # processes
+        return any(dataset.table_filter(table) for dataset in DATASETS
+                   if dataset.name in self.kinds)
+
+
+def _iter_table_blocks(filename, headings, selection=None):
+    '''
+    Generate the tables of a Word file along with their heading context.
+
+    ``headings`` is a ``_HeadingState`` instance which is used to track
+    the headings of the document. ``selection`` is an optional
+    ``Selection`` instance, tables that it does not select are skipped.
+
+    Generates a 2-tuple for each table (except for the Verrechnungen)
+    that contains the ``w:tbl`` element and the table's heading context
+    as returned by ``_HeadingState.context``. See ``iter_docx_blocks``
+    regarding the lifetime of the elements.
+    '''
+    log.info('Loading "{}"'.format(filename))
+    metrics.count('files')
+    headings.reset()
+    for element in iter_docx_blocks(filename):
+        if element.tag == _W_TBL:
+            if headings.verrechnungen:
+                log.debug('Ignoring Verrechnungen for THH "{}"'.format(
+                          headings.teilhaushalt['id']))
+                metrics.count('tables.verrechnungen')
+                continue
+            context = headings.context()
+            if selection is not None and not (
+                selection.matches_context(context) and
+                selection.matches_header(_extract_header(element), context)
+            ):
+                metrics.count('tables.skipped')
+                continue
+            yield element, context
+        else:
+            start = _clock()
+            headings.register_heading(paragraph_text(element))
+            metrics.add_time('headings', _clock() - start)
+
+
+def _table_from_block(element, context, compact=False):
+    '''
+    Create a ``Table`` from a ``w:tbl`` element and the table's heading
+    context.
+
+    If ``compact`` is true then a compact table is returned (see
+    ``Table.compact``).
+
+    Returns ``None`` if the table type is unknown.
+    '''
+    with metrics.timer('extract_data'):
+        data = extract_data(element)
+    metrics.count('rows', len(data))
+    try:
+        with metrics.timer('table_from_data'):
+            table = table_from_data(data)
+    except UnknownTableTypeException:
+        metrics.count('tables.unknown')
+        return None
+    metrics.count('tables.' + type(table).__name__)
+    table.teilhaushalt, table.produktbereich, table.produktgruppe = \
+        context[:3]
+    if compact:
+        table = table.compact()
+    return table
+
+
+def _warn_unknown_table(context):
+    log.warning(('Ignoring unknown table (last heading was ' +
+                '"{}").').format(context[3]))
 
-    log.addHandler(logging.StreamHandler())
-    if args.verbose == 0:
-        log.setLevel(logging.WARNING)
-    elif args.verbose == 1:
-        log.setLevel(logging.INFO)
-    elif args.verbose >= 2:
-        log.setLevel(logging.DEBUG)
 
+def iter_word_file(filename, headings, compact=False, selection=None):
+    '''
+    Parse the tables from a Word file one at a time.
+
+    ``headings`` is a ``_HeadingState`` instance which is used to track
+    the headings of the document.
+
+    If ``compact`` is true then the tables are stored in compact form
+    (see ``Table.compact``).
+
+    ``selection`` is an optional ``Selection`` instance, only the tables
+    selected by it are parsed.
+
+    Generates ``Table`` instances as soon as they are parsed.
+    '''
+    for element, context in _iter_table_blocks(filename, headings,
+                                               selection):
+        table = _table_from_block(element, context, compact)
+        if table is None:
+            _warn_unknown_table(context)
+        else:
+            yield table
+
+
+def load_word_file(filename, headings, compact=False, selection=None):
+    '''
+    Load the tables from a Word file.
+
+    See ``iter_word_file`` for the arguments.
+
+    Returns a list of ``Table`` instances.
+    '''
+    return list(iter_word_file(filename, headings, compact, selection))
+
+
+def _load_word_file_in_worker(filename, compact=False, selection=None):
+    '''
+    Load a Word file in a worker process.
+
+    Returns the tables and the Teilhaushalte of the file.
+    '''
     headings = _HeadingState()
-    tables = []
-    csv_options = {'delimiter': ',', 'quoting': csv.QUOTE_NONNUMERIC}
+    tables = load_word_file(filename, headings, compact, selection)
+    return tables, headings.teilhaushalte
+
+
+def _parse_table_in_worker(block, compact=False):
+    '''
+    Parse a single table in a worker process.
+
+    ``block`` is a 2-tuple containing the serialized ``w:tbl`` element
+    and the table's heading context.
+
+    Returns a ``Table`` instance or ``None`` if the table type is
+    unknown.
+    '''
+    xml, context = block
+    with metrics.timer('xml_parse'):
+        element = etree.fromstring(xml)
+    return _table_from_block(element, context, compact)
+
+
+def _call_in_worker(function, arg, **kwargs):
+    '''
+    Call a function in a worker process.
+
+    Returns a 2-tuple containing the function's return value and the
+    metrics that were collected during the call (see
+    ``Metrics.snapshot``).
+    '''
+    metrics.reset()
+    return function(arg, **kwargs), metrics.snapshot()
+
+
+def _merge_worker_metrics(results):
+    '''
+    Merge the metrics of calls to ``_call_in_worker`` into ``metrics``.
+
+    Generates the return values of the calls.
+    '''
+    for result, snapshot in results:
+        metrics.merge(snapshot)
+        yield result
+
+
+# Number of tables per worker that are collected by the sequential pass
+# before they are handed to the worker processes.
+_TABLE_BATCH_SIZE = 64
+
+
+def _load_tables_in_parallel(pool, jobs, filenames, headings,
+                             compact=False, selection=None):
+    '''
+    Load the tables from Word files, parsing the tables in parallel.
+
+    The documents are processed in two phases: A cheap sequential pass
+    over the documents tracks the headings and records the heading
+    context of each table. The tables are then parsed by the worker
+    processes of ``pool`` and the results are reassembled in document
+    order. The sequential pass works on batches of tables and prepares
+    the next batch while the workers parse the current one.
+
+    Generates ``Table`` instances.
+    '''
+    def iter_batches():
+        batch = []
+        for filename in filenames:
+            for element, context in _iter_table_blocks(filename, headings,
+                                                       selection):
+                batch.append((etree.tostring(element), context))
+                if len(batch) >= jobs * _TABLE_BATCH_SIZE:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def iter_results(batch, result):
+        tables = _merge_worker_metrics(result.get())
+        for (_, context), table in zip(batch, tables):
+            if table is None:
+                _warn_unknown_table(context)
+            else:
+                yield table
+
+    pending = None
+    for batch in iter_batches():
+        result = pool.map_async(functools.partial(_call_in_worker,
+                                                  _parse_table_in_worker,
+                                                  compact=compact),
+                                batch, _TABLE_BATCH_SIZE // 4)
+        if pending:
+            for table in iter_results(*pending):
+                yield table
+        pending = (batch, result)
+    if pending:
+        for table in iter_results(*pending):
+            yield table
+
+
+class ParseCache(object):
+    '''
+    On-disk cache for the results of parsing Word files.
 
+    Each entry contains the tables and the Teilhaushalte of one file.
+    Entries are keyed by a hash of the file's content, so renamed or
+    copied files are found in the cache, too. The key also includes
+    ``__version__`` and a hash of the code of this module, which
+    contains the parsers, so that entries are invalidated when the
+    parsers change.
 
-    def load_word_file(filename):
+    ``directory`` is the cache directory, it is created if necessary.
+
+    ``max_size`` is the maximum size of the cache in bytes. If the
+    cache grows larger than that then the least recently used entries
+    are removed.
+
+    The entries are stored as pickles, so the cache directory must not
+    be writable by untrusted users.
+    '''
+    extension = '.pickle'
+
+    def __init__(self, directory, max_size=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            # Another process may have created the directory meanwhile
+            if e.errno != errno.EEXIST or not os.path.isdir(directory):
+                raise
+        self._fingerprint = _code_fingerprint()
+
+    def key(self, filename, compact=False, selection=None):
         '''
-        Load data from a Word file.
+        Compute the cache key for a Word file.
+        '''
+        import hashlib
+
+        h = hashlib.sha256(self._fingerprint)
+        h.update(b'compact' if compact else b'full')
+        if selection is not None:
+            h.update(selection.key().encode('utf-8'))
+        with io.open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.extension)
 
-        Updates the ``headings`` and ``tables`` variables.
+    def touch(self, key):
         '''
-        log.info('Loading "{}"'.format(filename))
-        doc = Document(filename)
-        headings.reset()
-        for block in iter_block_items(doc):
-            if isinstance(block, WordTable):
-                if headings.verrechnungen:
-                    log.debug('Ignoring Verrechnungen for THH "{}"'.format(
-                              headings.teilhaushalt['id']))
-                    continue
-                data = extract_data(block)
-                try:
-                    table = table_from_data(data)
-                except UnknownTableTypeException:
-                    log.warning(('Ignoring unknown table (last heading was ' +
-                                '"{}").').format(headings.text))
+        Mark a cache entry as recently used without loading it.
+
+        Returns ``True`` if there is an entry for the key.
+        '''
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            return False
+        return True
+
+    def load(self, key):
+        '''
+        Load a cache entry.
+
+        Returns ``None`` if there is no usable entry for the key.
+        '''
+        path = self._path(key)
+        try:
+            with io.open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            log.warning('Ignoring broken cache entry "{}": {}'.format(path, e))
+            return None
+        try:
+            # Mark entry as recently used
+            os.utime(path, None)
+        except OSError:
+            pass
+        log.debug('Loaded cache entry "{}"'.format(path))
+        return value
+
+    def store(self, key, value):
+        '''
+        Store a cache entry and evict old entries if necessary.
+        '''
+        import tempfile
+
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            _replace_file(temp_path, self._path(key))
+        except:
+            os.remove(temp_path)
+            raise
+        self._evict()
+
+    def _evict(self):
+        '''
+        Remove the least recently used entries until the cache is small
+        enough.
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.extension):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(entry[1] for entry in entries)
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            log.debug('Evicting cache entry "{}"'.format(path))
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+def _code_fingerprint():
+    '''
+    Compute a fingerprint of the exporter's code and version.
+    '''
+    import hashlib
+    import inspect
+
+    h = hashlib.sha256()
+    h.update('{}\n{}\n'.format(__version__, __name__).encode('utf-8'))
+    try:
+        with io.open(inspect.getsourcefile(_HeadingState), 'rb') as f:
+            h.update(f.read())
+    except (IOError, TypeError):
+        log.warning('Could not read source code, cache entries are only ' +
+                    'invalidated when the version changes.')
+    return h.digest()
+
+
+def load_word_files(filenames, headings, jobs=1, parallel_tables=False,
+                    compact=False, cache=None, selection=None):
+    '''
+    Load the tables from several Word files.
+
+    ``headings`` is a ``_HeadingState`` instance which is used to track
+    the headings of the documents.
+
+    ``jobs`` is the number of worker processes. If it is larger than 1
+    then the files are parsed in parallel. The results are merged in
+    the order of ``filenames``, so that the tables and the headings
+    are the same as for a sequential run. ``None`` or ``0`` uses one
+    worker process per CPU.
+
+    If ``parallel_tables`` is true then the worker processes parse
+    individual tables instead of whole files. This allows a single large
+    document to use all worker processes.
+
+    If ``compact`` is true then the tables are stored in compact form
+    (see ``Table.compact``). This also reduces the amount of data that
+    has to be transferred from the worker processes.
+
+    ``cache`` is an optional ``ParseCache`` instance. Files whose
+    content is found in the cache are not parsed again.
+
+    ``selection`` is an optional ``Selection`` instance, only the tables
+    selected by it are parsed.
+
+    Generates ``Table`` instances in the order of the documents.
+    '''
+    import multiprocessing
+
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    if cache is not None:
+        for table in _load_word_files_cached(filenames, headings, jobs,
+                                             parallel_tables, compact, cache,
+                                             selection):
+            yield table
+        return
+    if not parallel_tables:
+        jobs = min(jobs, len(filenames))
+    if jobs <= 1:
+        for filename in filenames:
+            for table in iter_word_file(filename, headings, compact,
+                                        selection):
+                yield table
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        if parallel_tables:
+            for table in _load_tables_in_parallel(pool, jobs, filenames,
+                                                  headings, compact,
+                                                  selection):
+                yield table
+        else:
+            worker = functools.partial(_call_in_worker,
+                                       _load_word_file_in_worker,
+                                       compact=compact, selection=selection)
+            for tables, teilhaushalte in _merge_worker_metrics(
+                    pool.imap(worker, filenames)):
+                headings.merge_teilhaushalte(teilhaushalte)
+                for table in tables:
+                    yield table
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _load_word_files_cached(filenames, headings, jobs, parallel_tables,
+                            compact, cache, selection=None):
+    '''
+    Load the tables from several Word files using a ``ParseCache``.
+
+    Files that are not in the cache are parsed (using ``jobs`` worker
+    processes) and added to the cache. See ``load_word_files`` for the
+    other arguments.
+
+    Generates ``Table`` instances in the order of the documents. Only
+    the keys are computed up front, the cached entries are loaded one
+    at a time when their tables are needed.
+    '''
+    import multiprocessing
+
+    entries = []
+    missing = []
+    for filename in filenames:
+        key = cache.key(filename, compact, selection)
+        # Marking the entry as used keeps it from being evicted while
+        # the missing entries are stored.
+        cached = cache.touch(key)
+        if not cached:
+            missing.append(filename)
+            metrics.count('cache.misses')
+        entries.append((filename, key, cached))
+    if not parallel_tables:
+        jobs = min(jobs, len(missing))
+    pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+    try:
+        if pool is None:
+            worker = functools.partial(_load_word_file_in_worker,
+                                       compact=compact, selection=selection)
+            results = itertools.imap(worker, missing)
+        elif parallel_tables:
+            def parse_tables(filename):
+                file_headings = _HeadingState()
+                tables = list(_load_tables_in_parallel(
+                              pool, jobs, [filename], file_headings, compact,
+                              selection))
+                return tables, file_headings.teilhaushalte
+            results = itertools.imap(parse_tables, missing)
+        else:
+            worker = functools.partial(_call_in_worker,
+                                       _load_word_file_in_worker,
+                                       compact=compact, selection=selection)
+            results = _merge_worker_metrics(pool.imap(worker, missing))
+        for filename, key, cached in entries:
+            entry = cache.load(key) if cached else None
+            if entry is not None:
+                log.info('Using cached data for "{}"'.format(filename))
+                metrics.count('cache.hits')
+            else:
+                if cached:
+                    # The entry has been removed or is broken since
+                    # it was checked, parse the file here instead.
+                    metrics.count('cache.misses')
+                    entry = _load_word_file_in_worker(filename, compact,
+                                                      selection)
                 else:
-                    if headings.teilhaushalt:
-                        table.teilhaushalt = headings.teilhaushalt['id']
-                    if headings.produktbereich:
-                        table.produktbereich = headings.produktbereich['id']
-                    if headings.produktgruppe:
-                        table.produktgruppe = headings.produktgruppe['id']
-                    tables.append(table)
+                    entry = next(results)
+                cache.store(key, entry)
+            tables, teilhaushalte = entry
+            headings.merge_teilhaushalte(teilhaushalte)
+            for table in tables:
+                yield table
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+
+
+class Dataset(object):
+    '''
+    A dataset that is exported from the tables.
+
+    ``name`` is the name of the dataset. It is used as the base name of
+    the output files.
+
+    ``header`` is a list of column labels.
+
+    ``table_filter`` is a callback that gets a ``Table`` instance
+    and returns ``True`` if the table belongs to the dataset.
+
+    ``meta_columns`` is a list of the keys of the meta column which
+    should be exported from the table. Note that value columns are
+    always exported.
+
+    ``additional_fields`` is an optional callback that gets a a
+    ``Table`` instance and returns a list of additional fields.
+    These fields are prefixed to the fields of each row in the
+    table.
+    '''
+    def __init__(self, name, header, table_filter, meta_columns,
+                 additional_fields=None):
+        self.name = name
+        self.header = header
+        self.table_filter = table_filter
+        self.meta_columns = meta_columns
+        self.additional_fields = additional_fields
+
+    def dump_table(self, table, writer):
+        '''
+        Dump the rows of a table to a writer.
+
+        ``writer`` is an object with a ``writerows`` method, for example
+        one returned by ``open_writer``.
+        '''
+        if self.additional_fields:
+            add_cols = self.additional_fields(table)
+        else:
+            add_cols = None
+        table.dump_csv(writer, meta_columns=self.meta_columns,
+                       additional_columns=add_cols)
+
+
+DATASETS = [
+    Dataset('gesamtergebnishaushalt',
+            ['TITEL', 'JAHR', 'TYP', 'BETRAG'],
+            lambda t: isinstance(t, GesamtergebnishaushaltTable),
+            ['title']),
+    Dataset('teilergebnishaushalte',
+            ['TEILHAUSHALT', 'PRODUKTBEREICH', 'PRODUKTGRUPPE',
+             'KONTOGRUPPE', 'TITEL', 'JAHR', 'TYP', 'BETRAG'],
+            lambda t: isinstance(t, TeilergebnishaushaltTable),
+            ['kontogruppe', 'title'],
+            lambda t: [t.teilhaushalt, t.produktbereich, t.produktgruppe]),
+    Dataset('gesamtfinanzshaushalt',
+            ['TITEL', 'JAHR', 'TYP', 'BETRAG'],
+            lambda t: isinstance(t, FinanzhaushaltTable) and not t.teilhaushalt,
+            ['title']),
+    Dataset('teilfinanzhaushalte',
+            ['TEILHAUSHALT', 'TITEL', 'JAHR', 'TYP', 'BETRAG'],
+            lambda t: isinstance(t, FinanzhaushaltTable) and t.teilhaushalt,
+            ['title'],
+            lambda t: [t.teilhaushalt]),
+    Dataset('investitionsuebersichten',
+            ['TEILHAUSHALT', 'PROJEKTNUMMER', 'PROJEKT', 'TITEL', 'JAHR',
+             'TYP', 'BETRAG'],
+            lambda t: isinstance(t, InvestitionsuebersichtTable),
+            ['project_id', 'project_title', 'title'],
+            lambda t: [t.teilhaushalt]),
+]
+
+TEILHAUSHALTE_NAME = 'teilhaushalte'
+TEILHAUSHALTE_HEADER = ['NUMMER', 'TITEL']
+
+
+def _replace_file(source, target):
+    '''
+    Rename a file, replacing the target if it exists.
+
+    On POSIX systems the target is replaced atomically. On Windows,
+    where Python 2 cannot rename a file to an existing name, the target
+    is removed first, so there is a short time during which it does not
+    exist.
+    '''
+    try:
+        os.rename(source, target)
+    except OSError:
+        if os.name != 'nt' or not os.path.exists(target):
+            raise
+        os.remove(target)
+        os.rename(source, target)
+
+
+class _AtomicFile(object):
+    '''
+    Temporary file that replaces a file once it has been written.
+
+    The temporary file (``path``) is created next to ``filename`` and is
+    renamed to ``filename`` by ``commit``. Since the rename is atomic,
+    readers of ``filename`` see either its previous or its complete new
+    content, but never a partially written file (on Windows, ``filename``
+    is missing for a moment instead, see ``_replace_file``). ``discard``
+    removes the temporary file instead.
+    '''
+    _counter = itertools.count()
+
+    def __init__(self, filename):
+        self.filename = filename
+        directory, name = os.path.split(os.path.abspath(filename))
+        while True:
+            self.path = os.path.join(directory, '.{}.{}-{}.tmp'.format(
+                                     name, os.getpid(), next(self._counter)))
+            try:
+                # In contrast to ``tempfile.mkstemp`` this creates the file
+                # with the same permissions as a regular output file.
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                             0o666)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
             else:
-                headings.register_heading(block.text)
+                os.close(fd)
+                break
+
+    def commit(self):
+        _replace_file(self.path, self.filename)
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def _csv_string(value):
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _csv_number(value):
+    return unicode(value)
 
 
-    def dump_tables_to_csv(filename, table_filter, header, meta_columns,
-                           additional_fields=None):
+# Formatters for the fields of a CSV row by type of the field's value,
+# other types are handled by ``_csv_field``.
+_CSV_FIELD_FORMATTERS = {
+    unicode: _csv_string,
+    str: lambda value: _csv_string(unicode(value)),
+    Decimal: _csv_number,
+    int: _csv_number,
+    long: _csv_number,
+    type(None): lambda value: '""',
+}
+
+
+def _csv_field(value):
+    '''
+    Format the field of a CSV row.
+
+    Gives the same result as ``csv.writer`` with the ``QUOTE_NONNUMERIC``
+    quoting: Numbers are written as they are, all other values are
+    quoted.
+    '''
+    try:
+        return _CSV_FIELD_FORMATTERS[type(value)](value)
+    except KeyError:
+        if isinstance(value, numbers.Number):
+            return _csv_number(value)
+        return _csv_string(unicode(value))
+
+
+def _csv_row(row):
+    return ','.join(map(_csv_field, row))
+
+
+class _CsvStreamWriter(object):
+    '''
+    Write rows in the format of ``CsvWriter`` to a file-like object.
+    '''
+    def __init__(self, stream):
+        self._stream = stream
+
+    def writerow(self, row):
+        self._stream.write(_csv_row(row) + '\r\n')
+
+    def writerows(self, rows):
+        self._stream.write(''.join(_csv_row(row) + '\r\n' for row in rows))
+
+
+class CsvWriter(object):
+    '''
+    Write rows to a CSV file.
+
+    The header row is written when the file is opened. The rows are
+    formatted in batches of ``batch_size`` rows, each batch is written
+    to the file at once. The file is written to a temporary file that
+    replaces the output file when the writer is closed (see
+    ``_AtomicFile``).
+
+    ``close`` is the same as ``finish`` followed by ``commit``. Calling
+    them separately allows writing several files completely before
+    replacing any of them. If ``finish`` fails then the temporary file
+    is removed.
+    '''
+    extension = 'csv'
+    batch_size = 1000
+
+    def __init__(self, filename, header, int_columns=()):
+        self._output = _AtomicFile(filename)
+        try:
+            self._file = io.open(self._output.path, 'wb')
+        except:
+            self._output.discard()
+            raise
+        self._lines = []
+        self.writerow(header)
+
+    def writerow(self, row):
+        self._lines.append(_csv_row(row))
+        if len(self._lines) >= self.batch_size:
+            self._flush()
+
+    def writerows(self, rows):
+        self._lines.extend(_csv_row(row) for row in rows)
+        if len(self._lines) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._lines:
+            self._lines.append('')
+            self._file.write('\r\n'.join(self._lines).encode('utf-8'))
+            self._lines = []
+
+    def finish(self):
+        try:
+            try:
+                self._flush()
+            finally:
+                self._file.close()
+        except:
+            self._output.discard()
+            raise
+
+    def commit(self):
+        self._output.commit()
+
+    def close(self):
+        self.finish()
+        self.commit()
+
+    def discard(self):
+        self._file.close()
+        self._output.discard()
+
+
+# Types of the columns in typed output formats. Other columns contain
+# strings, unless they are passed as ``int_columns`` to ``open_writer``.
+_INT_COLUMNS = {'JAHR'}
+_DECIMAL_COLUMNS = {'BETRAG', 'BETRAG_ALT', 'BETRAG_NEU'}
+_DECIMAL_PRECISION = 18
+
+
+class _ArrowWriter(object):
+    '''
+    Base class for writers of column-oriented formats based on Arrow.
+
+    Rows are collected column by column and written in batches of
+    ``batch_size`` rows. Like ``CsvWriter``, the data is written to a
+    temporary file that replaces the output file when the writer is
+    closed (or committed). Requires the ``pyarrow`` package.
+    '''
+    batch_size = 65536
+
+    def __init__(self, filename, header, int_columns=()):
+        try:
+            import pyarrow
+        except ImportError:
+            raise BudgetExportException(('The "{}" format requires the ' +
+                                        'pyarrow package.').format(
+                                        self.extension))
+        self._pa = pyarrow
+        self._int_columns = _INT_COLUMNS.union(int_columns)
+        self._schema = pyarrow.schema([pyarrow.field(str(label),
+                                      self._column_type(label))
+                                      for label in header])
+        self._columns = [[] for _ in header]
+        self._output = _AtomicFile(filename)
+        try:
+            self._writer = self._open(self._output.path)
+        except:
+            self._output.discard()
+            raise
+
+    def _column_type(self, label):
+        if label in self._int_columns:
+            return self._pa.int32()
+        if label in _DECIMAL_COLUMNS:
+            return self._pa.decimal128(_DECIMAL_PRECISION, 2)
+        return self._pa.string()
+
+    def _open(self, filename):
+        raise NotImplementedError('Must be implemented in subclass')
+
+    def _write_batch(self, batch):
+        raise NotImplementedError('Must be implemented in subclass')
+
+    def writerow(self, row):
+        for column, value in zip(self._columns, row):
+            column.append(value)
+        if len(self._columns[0]) >= self.batch_size:
+            self._flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def _flush(self):
+        if not self._columns[0]:
+            return
+        arrays = [self._pa.array(column, type=field.type)
+                  for column, field in zip(self._columns, self._schema)]
+        self._write_batch(self._pa.RecordBatch.from_arrays(
+                          arrays, self._schema.names))
+        for column in self._columns:
+            del column[:]
+
+    def _close_writer(self):
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+
+    def finish(self):
+        try:
+            try:
+                self._flush()
+            finally:
+                self._close_writer()
+        except:
+            self._output.discard()
+            raise
+
+    def commit(self):
+        self._output.commit()
+
+    def close(self):
+        self.finish()
+        self.commit()
+
+    def discard(self):
+        try:
+            self._close_writer()
+        finally:
+            self._output.discard()
+
+
+class ParquetWriter(_ArrowWriter):
+    '''
+    Write rows to a Parquet file.
+    '''
+    extension = 'parquet'
+
+    def _open(self, filename):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(filename, self._schema)
+
+    def _write_batch(self, batch):
+        self._writer.write_table(self._pa.Table.from_batches([batch]))
+
+
+class ArrowFileWriter(_ArrowWriter):
+    '''
+    Write rows to an Arrow IPC file.
+    '''
+    extension = 'arrow'
+
+    def _open(self, filename):
+        return self._pa.RecordBatchFileWriter(filename, self._schema)
+
+    def _write_batch(self, batch):
+        self._writer.write_batch(batch)
+
+
+OUTPUT_FORMATS = {
+    CsvWriter.extension: CsvWriter,
+    ParquetWriter.extension: ParquetWriter,
+    ArrowFileWriter.extension: ArrowFileWriter,
+}
+
+
+class _MultiWriter(object):
+    '''
+    Write rows to several writers.
+    '''
+    def __init__(self, writers):
+        self._writers = writers
+
+    def writerow(self, row):
+        for writer in self._writers:
+            writer.writerow(row)
+
+    def writerows(self, rows):
+        rows = list(rows)
+        for writer in self._writers:
+            writer.writerows(rows)
+
+    def finish(self):
+        for writer in self._writers:
+            writer.finish()
+
+    def commit(self):
+        for writer in self._writers:
+            writer.commit()
+
+    def close(self):
+        self.finish()
+        self.commit()
+
+    def discard(self):
+        for writer in self._writers:
+            writer.discard()
+
+
+class SqliteWriter(object):
+    '''
+    Write the datasets to a SQLite database.
+
+    In contrast to the other output formats, all datasets are written
+    to a single database file with a normalized schema:
+
+    - ``teilhaushalte``, ``produktbereiche`` and ``produktgruppen`` contain
+      the IDs and titles of the Teilhaushalte, Produktbereiche and
+      Produktgruppen.
+
+    - ``positions`` contains one row per row of the exported datasets
+      (without the value columns). ``dataset`` is the name of the
+      dataset and ``teilhaushalt``, ``produktbereich`` and
+      ``produktgruppe`` are the IDs of the table's Teilhaushalt,
+      Produktbereich and Produktgruppe.
+
+    - ``amounts`` contains the values of the positions. The amounts are
+      stored as integer cents.
+
+    ``datasets`` is an optional list of the names of the datasets that
+    are written, by default all datasets are written.
+
+    The database is written to a temporary file that replaces an
+    existing database file when the writer is closed (see
+    ``_AtomicFile``). The rows are inserted in batches and the indexes
+    are created once all data has been written. The data is written in
+    WAL mode, which is switched back to the default rollback journal
+    before the database is closed. Otherwise the database would stay in
+    WAL mode and readers would need write access to its directory.
+    '''
+    batch_size = 10000
+
+    _SCHEMA = '''
+        CREATE TABLE teilhaushalte (
+            id TEXT PRIMARY KEY,
+            title TEXT
+        );
+        CREATE TABLE produktbereiche (
+            teilhaushalt TEXT REFERENCES teilhaushalte (id),
+            id TEXT,
+            title TEXT,
+            PRIMARY KEY (teilhaushalt, id)
+        );
+        CREATE TABLE produktgruppen (
+            teilhaushalt TEXT,
+            produktbereich TEXT,
+            id TEXT,
+            title TEXT,
+            PRIMARY KEY (teilhaushalt, produktbereich, id),
+            FOREIGN KEY (teilhaushalt, produktbereich)
+                REFERENCES produktbereiche (teilhaushalt, id)
+        );
+        CREATE TABLE positions (
+            id INTEGER PRIMARY KEY,
+            dataset TEXT NOT NULL,
+            teilhaushalt TEXT,
+            produktbereich TEXT,
+            produktgruppe TEXT,
+            kontogruppe TEXT,
+            project_id TEXT,
+            project_title TEXT,
+            title TEXT
+        );
+        CREATE TABLE amounts (
+            position INTEGER NOT NULL REFERENCES positions (id),
+            year INTEGER,
+            type TEXT,
+            amount INTEGER
+        );
+    '''
+
+    _INDEXES = '''
+        CREATE INDEX positions_dataset ON positions (dataset);
+        CREATE INDEX positions_hierarchy
+            ON positions (teilhaushalt, produktbereich, produktgruppe);
+        CREATE INDEX amounts_position ON amounts (position);
+        CREATE INDEX amounts_year_type ON amounts (year, type);
+    '''
+
+    _POSITION_COLUMNS = ['kontogruppe', 'project_id', 'project_title',
+                         'title']
+
+    # Suffixes of the files that SQLite creates next to a database
+    _AUXILIARY_SUFFIXES = ('-wal', '-shm', '-journal')
+
+    def __init__(self, filename, datasets=None):
+        import sqlite3
+
+        self._datasets = [dataset for dataset in DATASETS
+                          if not datasets or dataset.name in datasets]
+        self._output = _AtomicFile(filename)
+        self._connection = None
+        try:
+            self._connection = sqlite3.connect(self._output.path)
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.execute('PRAGMA synchronous = NORMAL')
+            self._connection.executescript(self._SCHEMA)
+        except:
+            self.discard()
+            raise
+        self._positions = []
+        self._amounts = []
+        self._next_id = 1
+
+    def write_table(self, table):
         '''
-        Dump tables to a CSV file.
+        Write the rows of a table.
 
-        ``filename`` is the name of the file.
+        The table is written as part of every selected dataset it
+        belongs to.
+        '''
+        context = [table.teilhaushalt, table.produktbereich,
+                   table.produktgruppe]
+        for dataset in self._datasets:
+            if not dataset.table_filter(table):
+                continue
+            columns = [key for key in self._POSITION_COLUMNS
+                       if key in dataset.meta_columns]
+            indices = [self._POSITION_COLUMNS.index(key) for key in columns]
+            for fields, values in table._flat_records(columns):
+                row = [self._next_id, dataset.name] + context + [None] * 4
+                for i, value in zip(indices, fields):
+                    row[5 + i] = value
+                self._positions.append(row)
+                for value in values:
+                    self._amounts.append((self._next_id, value.year,
+                                          value.type,
+                                          int(value.amount.scaleb(2))))
+                self._next_id += 1
+        if len(self._amounts) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        with self._connection:
+            self._connection.executemany(
+                'INSERT INTO positions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                self._positions)
+            self._connection.executemany(
+                'INSERT INTO amounts VALUES (?, ?, ?, ?)', self._amounts)
+        self._positions = []
+        self._amounts = []
+
+    def write_teilhaushalte(self, headings):
+        '''
+        Write the Teilhaushalte, Produktbereiche and Produktgruppen.
 
-        ``table_filter`` is a callback that gets a ``Table`` instance
-        and returns ``True`` if the table should be dumped.
+        ``headings`` is the ``_HeadingState`` that was used for loading
+        the tables.
+        '''
+        thhs, pbs, pgs = [], [], []
+        for thh in headings.teilhaushalte.itervalues():
+            thhs.append((thh['id'], thh['title']))
+            for pb in thh['produktbereiche'].itervalues():
+                pbs.append((thh['id'], pb['id'], pb['title']))
+                for pg in pb['produktgruppen'].itervalues():
+                    pgs.append((thh['id'], pb['id'], pg['id'], pg['title']))
+        with self._connection:
+            self._connection.executemany(
+                'INSERT INTO teilhaushalte VALUES (?, ?)', thhs)
+            self._connection.executemany(
+                'INSERT INTO produktbereiche VALUES (?, ?, ?)', pbs)
+            self._connection.executemany(
+                'INSERT INTO produktgruppen VALUES (?, ?, ?, ?)', pgs)
+
+    def finish(self):
+        '''
+        Write the remaining rows, create the indexes and close the
+        database.
 
-        ``header`` is a list of header labels for the first row of the
-        CSV file.
+        The database is removed if this fails.
+        '''
+        try:
+            try:
+                self._flush()
+                self._connection.executescript(self._INDEXES)
+                self._connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                self._connection.execute('PRAGMA journal_mode = DELETE')
+            finally:
+                self._close_connection()
+        except:
+            self.discard()
+            raise
+
+    def commit(self):
+        '''
+        Replace the database file by the finished database.
+        '''
+        # Files that belong to a previous database would be applied to
+        # the new one
+        self._remove_auxiliary_files(self._output.filename)
+        self._output.commit()
 
-        ``meta_columns`` is a list of the keys of the meta column which
-        should be exported from the table. Note that value columns are
-        always exported.
+    def close(self):
+        self.finish()
+        self.commit()
 
-        ``additional_fields`` is an optional callback that gets a a
-        ``Table`` instance and returns a list of additional fields.
-        These fields are prefixed to the fields of each row in the
-        table.
+    def discard(self):
         '''
-        log.info('Exporting data to "{}"'.format(filename))
-        with io.open(filename, 'w') as f:
-            writer = csv.writer(f, **csv_options)
-            writer.writerow(header)
-            for table in tables:
-                if table_filter(table):
-                    if additional_fields:
-                        add_cols = additional_fields(table)
-                    else:
-                        add_cols = None
-                    table.dump_csv(writer, meta_columns=meta_columns,
-                                   additional_columns=add_cols)
+        Close the database and remove it.
+        '''
+        try:
+            self._close_connection()
+        finally:
+            self._output.discard()
+            self._remove_auxiliary_files(self._output.path)
+
+    def _close_connection(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            connection.close()
+
+    def _remove_auxiliary_files(self, filename):
+        for suffix in self._AUXILIARY_SUFFIXES:
+            if os.path.exists(filename + suffix):
+                os.remove(filename + suffix)
+
+
+def open_writer(name, header, formats=('csv',), int_columns=()):
+    '''
+    Open the output files for a dataset.
+
+    ``name`` is the base name of the output files, ``header`` is the
+    list of column labels, and ``formats`` is a list of keys of
+    ``OUTPUT_FORMATS``. ``int_columns`` are the labels of additional
+    columns that typed formats store as integers (see ``_INT_COLUMNS``).
+
+    Returns an object with ``writerow`` and ``writerows`` methods. The
+    output files are only created once the object's ``close`` method is
+    called, its ``discard`` method removes the data that has been
+    written so far instead (see ``_AtomicFile``). ``close`` can also be
+    split into ``finish``, which completes the temporary files, and
+    ``commit``, which replaces the output files with them.
+    '''
+    writers = []
+    try:
+        for format in formats:
+            cls = OUTPUT_FORMATS[format]
+            filename = '{}.{}'.format(name, cls.extension)
+            log.info('Exporting data to "{}"'.format(filename))
+            writers.append(cls(filename, header, int_columns))
+    except:
+        for writer in writers:
+            writer.discard()
+        raise
+    if len(writers) == 1:
+        return writers[0]
+    return _MultiWriter(writers)
+
+
+@contextlib.contextmanager
+def _committing(writer):
+    '''
+    Context manager that closes a writer.
+
+    If an exception occurs then the writer's output is discarded
+    instead, so that existing output files are kept.
+    '''
+    try:
+        yield writer
+        writer.finish()
+    except:
+        writer.discard()
+        raise
+    writer.commit()
+
+
+def dump_tables(tables, dataset, formats=('csv',)):
+    '''
+    Dump the tables that belong to a dataset.
+
+    ``dataset`` is a ``Dataset`` instance and ``formats`` is a list of
+    keys of ``OUTPUT_FORMATS``.
+    '''
+    with _committing(open_writer(dataset.name, dataset.header,
+                                 formats)) as writer:
+        for table in tables:
+            if dataset.table_filter(table):
+                dataset.dump_table(table, writer)
+
+
+def dump_list_of_teilhaushalte(headings, formats=('csv',)):
+    '''
+    Dump a list of all Teilhaushalte.
+
+    Exports the Teilhaushalte with their ID and title.
+    '''
+    with _committing(open_writer(TEILHAUSHALTE_NAME, TEILHAUSHALTE_HEADER,
+                                 formats)) as writer:
+        _dump_teilhaushalte(headings, writer)
 
 
-    def dump_list_of_teilhaushalte(filename):
+def _dump_teilhaushalte(headings, writer):
+    thhs = sorted(headings.teilhaushalte.itervalues(),
+                  key=lambda thh: thh['id'])
+    for thh in thhs:
+        writer.writerow([thh['id'], thh['title']])
+
+
+def export_tables(tables, headings, formats=('csv',), database=None,
+                  datasets=None):
+    '''
+    Export tables and Teilhaushalte to the files of all datasets.
+
+    ``tables`` is an iterable of ``Table`` instances and ``headings`` is
+    the ``_HeadingState`` instance that is used for loading them.
+    ``formats`` is a list of keys of ``OUTPUT_FORMATS``. ``database`` is
+    the filename of an optional SQLite database to which the datasets
+    are written, too (see ``SqliteWriter``). ``datasets`` is an
+    optional list of the names of the datasets that are exported, by
+    default all datasets are exported.
+
+    The output files of all datasets are opened up front and the
+    tables are written to them in a single pass over ``tables``. If
+    ``tables`` is a generator (for example one returned by
+    ``load_word_files``) then each table is written as soon as it has
+    been parsed, so that only a single table needs to be kept in
+    memory. The Teilhaushalte are exported once all tables have been
+    processed. The output files are only replaced once all of them
+    have been written completely. If an error occurs before that then
+    no output files are replaced.
+    '''
+    # Dataset writers and all writers that have been opened
+    writers = []
+    outputs = []
+    sqlite_writer = None
+    try:
+        if formats:
+            for dataset in DATASETS:
+                if datasets and dataset.name not in datasets:
+                    continue
+                writer = open_writer(dataset.name, dataset.header, formats)
+                outputs.append(writer)
+                writers.append((dataset, writer))
+        if database:
+            sqlite_writer = SqliteWriter(database, datasets)
+            outputs.append(sqlite_writer)
+        for table in tables:
+            start = _clock()
+            for dataset, writer in writers:
+                if dataset.table_filter(table):
+                    dataset.dump_table(table, writer)
+            if sqlite_writer:
+                sqlite_writer.write_table(table)
+            metrics.add_time('write', _clock() - start)
+        with metrics.timer('write'):
+            if sqlite_writer:
+                sqlite_writer.write_teilhaushalte(headings)
+            if formats:
+                writer = open_writer(TEILHAUSHALTE_NAME, TEILHAUSHALTE_HEADER,
+                                     formats)
+                outputs.append(writer)
+                _dump_teilhaushalte(headings, writer)
+            for output in outputs:
+                output.finish()
+    except:
+        for output in outputs:
+            output.discard()
+        raise
+    with metrics.timer('write'):
+        for output in outputs:
+            output.commit()
+
+
+def validate_tables(tables):
+    '''
+    Check the summary positions of tables.
+
+    Logs a warning for each amount of a summary position that does not
+    match the amounts of the other positions (see
+    ``Table.check_summaries``).
+
+    Generates the tables, so that the check can be inserted between
+    ``load_word_files`` and ``export_tables`` without keeping the tables
+    in memory.
+    '''
+    for table in tables:
+        with metrics.timer('validate'):
+            mismatches = table.check_summaries()
+        for position, index, expected in mismatches:
+            metrics.count('summary_mismatches')
+            value = position['values'][index]
+            log.warning(('Summary mismatch in {} (THH {}, PB {}, PG {}), ' +
+                        'position {} "{}", {} {}: {} instead of {}').format(
+                        table._table_class.__name__ if isinstance(
+                        table, _CompactTableMixin) else type(table).__name__,
+                        table.teilhaushalt, table.produktbereich,
+                        table.produktgruppe, position['number'],
+                        position['title'], value.type, value.year,
+                        value.amount, expected))
+        yield table
+
+
+ROLLUP_FILENAME = 'rollup.json'
+
+
+def _node_key(table):
+    '''
+    Return the key of the hierarchy node that a table belongs to.
+
+    The key is a tuple of the IDs of the table's Teilhaushalt,
+    Produktbereich and Produktgruppe, up to the first one that is not
+    set.
+    '''
+    key = []
+    for id in (table.teilhaushalt, table.produktbereich, table.produktgruppe):
+        if not id:
+            break
+        key.append(id)
+    return tuple(key)
+
+
+class RollupIndex(object):
+    '''
+    Sums of the Teilergebnishaushalte per node of the budget hierarchy.
+
+    The nodes are the whole budget, the Teilhaushalte, and their
+    Produktbereiche and Produktgruppen. For each node, the amounts of
+    the exported rows of the Teilergebnishaushalte are summed up by
+    year, type and Kontogruppe. If a node has Teilergebnishaushalte of
+    its own (for example a Produktbereich) then its sums are those of
+    its own tables, since these already contain the data of its
+    children. Otherwise the sums of a node are the sums of its
+    children.
+
+    The tables are added during loading via ``collect`` (or
+    ``add_table``), so that they do not have to be kept in memory.
+    '''
+    def __init__(self):
+        # Sums of the node's own tables in cents by node key (see
+        # ``_node_key``) and by year, type and Kontogruppe
+        self._sums = {}
+
+    def add_table(self, table):
         '''
-        Dump a list of all Teilhaushalte.
+        Add the amounts of a table.
 
-        Exports the Teilhaushalte to CSV with their ID and title.
+        Tables other than Teilergebnishaushalte are ignored.
         '''
-        thhs = sorted(headings.teilhaushalte.itervalues(),
-                      key=lambda thh: thh['id'])
-        with io.open(filename, 'w') as f:
-            writer = csv.writer(f, **csv_options)
-            writer.writerow(['NUMMER', 'TITEL'])
-            for thh in thhs:
-                writer.writerow([thh['id'], thh['title']])
+        if not isinstance(table, TeilergebnishaushaltTable):
+            return
+        sums = self._sums.setdefault(_node_key(table), {})
+        for (kontogruppe,), values in table._flat_records(['kontogruppe']):
+            for value in values:
+                key = (value.year, value.type, kontogruppe or '')
+                sums[key] = sums.get(key, 0) + _amount_cents(value.amount)
 
+    def collect(self, tables):
+        '''
+        Add the amounts of several tables.
+
+        Generates the tables, so that this can be inserted between
+        ``load_word_files`` and ``export_tables``.
+        '''
+        for table in tables:
+            with metrics.timer('rollup'):
+                self.add_table(table)
+            yield table
 
-    for filename in args.filenames:
-        if filename.endswith(b'.docx'):
-            load_word_file(filename)
+    def nodes(self, headings=None):
+        '''
+        Compute the sums of all nodes.
+
+        ``headings`` is an optional ``_HeadingState`` instance, which
+        provides the titles of the nodes. It also adds the nodes for
+        which no tables have been loaded.
+
+        Returns a dict that maps the key of each node (see
+        ``_node_key``) to a dict with the node's ``title``, the sorted
+        list of the keys of its ``children``, and its ``amounts``, a
+        dict that maps 3-tuples of year, type and Kontogruppe to the
+        sum in cents.
+        '''
+        titles = {}
+        if headings is not None:
+            for thh in headings.teilhaushalte.itervalues():
+                titles[(thh['id'],)] = thh['title']
+                for pb in thh['produktbereiche'].itervalues():
+                    titles[(thh['id'], pb['id'])] = pb['title']
+                    for pg in pb['produktgruppen'].itervalues():
+                        titles[(thh['id'], pb['id'], pg['id'])] = \
+                            pg['title']
+        children = collections.defaultdict(set)
+        for key in itertools.chain(self._sums, titles):
+            while key:
+                children[key[:-1]].add(key)
+                key = key[:-1]
+        nodes = {}
+
+        def rollup(key):
+            child_keys = sorted(children.get(key, ()))
+            child_sums = [rollup(child) for child in child_keys]
+            if key in self._sums:
+                amounts = dict(self._sums[key])
+            else:
+                amounts = {}
+                for sums in child_sums:
+                    for k, cents in sums.iteritems():
+                        amounts[k] = amounts.get(k, 0) + cents
+            nodes[key] = {'title': titles.get(key), 'children': child_keys,
+                          'amounts': amounts}
+            return amounts
+
+        rollup(())
+        return nodes
+
+    def write(self, filename, headings=None):
+        '''
+        Write the index to a JSON file.
+
+        The file contains an object that maps the ID of each node to
+        an object with the node's ``title``, the IDs of its
+        ``children`` and its ``amounts`` in cents by year, type and
+        Kontogruppe. The ID of a node consists of the IDs of its
+        Teilhaushalt, Produktbereich and Produktgruppe, separated by
+        ``/``. The whole budget has the empty ID. See ``nodes`` for
+        ``headings``.
+        '''
+        data = {}
+        for key, node in self.nodes(headings).iteritems():
+            amounts = {}
+            sums = node['amounts']
+            for (year, type, kontogruppe), cents in sums.iteritems():
+                amounts.setdefault(year, {}).setdefault(type, {})[
+                    kontogruppe] = cents
+            data['/'.join(key)] = {
+                'title': node['title'],
+                'children': ['/'.join(child) for child in node['children']],
+                'amounts': amounts,
+            }
+        log.info('Exporting rollup index to "{}"'.format(filename))
+        output = _AtomicFile(filename)
+        try:
+            with io.open(output.path, 'wb') as f:
+                json.dump(data, f, sort_keys=True, separators=(',', ':'))
+        except:
+            output.discard()
+            raise
+        output.commit()
+
+
+class _RowCollector(object):
+    '''
+    Writer that collects the rows in a list.
+    '''
+    def __init__(self):
+        self.rows = []
+        self.writerow = self.rows.append
+        self.writerows = self.rows.extend
+
+
+def iter_records(filenames, kinds=None, headings=None, **kwargs):
+    '''
+    Generate the records from several Word files.
+
+    This is the counterpart of ``export_tables`` for using the exporter
+    as a library: Instead of writing the datasets to files, their rows
+    are generated as soon as the tables are parsed. The iteration can be
+    stopped at any time, the remaining parts of the documents are not
+    parsed in that case.
+
+    ``kinds`` is an optional list of dataset names (see ``DATASETS``).
+    By default, the records of all datasets are generated. Tables that
+    do not belong to these datasets are not parsed, unless a
+    ``selection`` is given (see ``load_word_files``).
+
+    ``headings`` is an optional ``_HeadingState`` instance which is used
+    to track the headings of the documents. Once all records have been
+    generated its ``teilhaushalte`` attribute contains the Teilhaushalte
+    with their Produktbereiche and Produktgruppen.
+
+    The remaining keyword arguments are passed on to ``load_word_files``.
+
+    Each record is a dict that contains the name of its dataset
+    (``dataset``), the IDs of the table's Teilhaushalt, Produktbereich
+    and Produktgruppe (``teilhaushalt``, ``produktbereich``,
+    ``produktgruppe``, each of which may be ``None``), the dataset's
+    meta columns (for example ``title``) and the ``year``, ``type`` and
+    ``amount`` of the value. The records correspond to the rows of the
+    exported files.
+    '''
+    datasets = DATASETS
+    if kinds is not None:
+        names = set(kinds)
+        unknown = names.difference(dataset.name for dataset in DATASETS)
+        if unknown:
+            raise ValueError('Unknown dataset(s): {}'.format(
+                             ', '.join(sorted(unknown))))
+        datasets = [dataset for dataset in DATASETS if dataset.name in names]
+        kwargs.setdefault('selection', Selection(kinds=names))
+    if headings is None:
+        headings = _HeadingState()
+    for table in load_word_files(filenames, headings, **kwargs):
+        for dataset in datasets:
+            if not dataset.table_filter(table):
+                continue
+            collector = _RowCollector()
+            table.dump_csv(collector, meta_columns=dataset.meta_columns)
+            for row in collector.rows:
+                record = {
+                    'dataset': dataset.name,
+                    'teilhaushalt': table.teilhaushalt,
+                    'produktbereich': table.produktbereich,
+                    'produktgruppe': table.produktgruppe,
+                    'year': row[-3],
+                    'type': row[-2],
+                    'amount': row[-1],
+                }
+                record.update(zip(dataset.meta_columns, row))
+                yield record
+
+
+DIFF_NAME = 'diff'
+DIFF_HEADER = ['ALT', 'NEU', 'DATENSATZ', 'TEILHAUSHALT', 'PRODUKTBEREICH',
+               'PRODUKTGRUPPE', 'KONTOGRUPPE', 'PROJEKTNUMMER', 'NUMMER',
+               'TITEL', 'JAHR', 'TYP', 'BETRAG_ALT', 'BETRAG_NEU', 'STATUS']
+
+# Columns of ``DIFF_HEADER`` that contain integers in addition to
+# ``_INT_COLUMNS``. In the other datasets, ``NUMMER`` contains IDs.
+_DIFF_INT_COLUMNS = {'NUMMER'}
+
+# Meta columns that identify a position in ``diff_budgets``
+_DIFF_KEY_COLUMNS = ['kontogruppe', 'project_id', 'number', 'title']
+
+
+def _index_amounts(tables):
+    '''
+    Index the amounts of tables for ``diff_budgets``.
+
+    Returns a list of the keys in document order and a dict that maps
+    the keys to the amounts. A key is a tuple containing the name of
+    the dataset, the IDs of the Teilhaushalt, Produktbereich and
+    Produktgruppe, the values of ``_DIFF_KEY_COLUMNS``, the year and the
+    type of an amount. If a key occurs more than once then the number of
+    the occurrence is appended to it, so that duplicates are compared in
+    order.
+    '''
+    keys = []
+    index = {}
+    for table in tables:
+        context = (table.teilhaushalt, table.produktbereich,
+                   table.produktgruppe)
+        for dataset in DATASETS:
+            if not dataset.table_filter(table):
+                continue
+            columns = [key for key in _DIFF_KEY_COLUMNS
+                       if key == 'number' or key in dataset.meta_columns]
+            for fields, values in table._flat_records(columns):
+                record = dict(zip(columns, fields))
+                prefix = ((dataset.name,) + context +
+                          tuple(record.get(key) for key in _DIFF_KEY_COLUMNS))
+                for value in values:
+                    key = prefix + (value.year, value.type)
+                    if key in index:
+                        n = 1
+                        while key + (n,) in index:
+                            n += 1
+                        key += (n,)
+                    keys.append(key)
+                    index[key] = value.amount
+    return keys, index
+
+
+def diff_budgets(versions, **kwargs):
+    '''
+    Compare the amounts of several versions of a budget.
+
+    ``versions`` is a list of 2-tuples, each of which contains a label
+    and a list of the Word files of a version. Each version is compared
+    with the previous one. Only two versions are kept in memory at a
+    time.
+
+    The remaining keyword arguments are passed on to
+    ``load_word_files``.
+
+    Generates a list of fields (see ``DIFF_HEADER``) for each amount
+    that was added, removed or changed. The status is ``added``,
+    ``removed`` or ``changed``, respectively.
+    '''
+    previous = None
+    for label, filenames in versions:
+        log.info('Loading version "{}"'.format(label))
+        keys, index = _index_amounts(load_word_files(filenames,
+                                     _HeadingState(), **kwargs))
+        if previous is not None:
+            old_label, old_keys, old_index = previous
+            for key in keys:
+                amount = index[key]
+                old_amount = old_index.get(key, _MISSING)
+                if old_amount is _MISSING:
+                    yield ([old_label, label] + list(key[:10]) +
+                           [None, amount, 'added'])
+                elif old_amount != amount:
+                    yield ([old_label, label] + list(key[:10]) +
+                           [old_amount, amount, 'changed'])
+            for key in old_keys:
+                if key not in index:
+                    yield ([old_label, label] + list(key[:10]) +
+                           [old_index[key], None, 'removed'])
+        previous = label, keys, index
+
+
+def dump_diff(versions, formats=('csv',), **kwargs):
+    '''
+    Export the differences between several versions of a budget.
+
+    See ``diff_budgets`` for the arguments. ``formats`` is a list of
+    keys of ``OUTPUT_FORMATS``.
+    '''
+    with _committing(open_writer(DIFF_NAME, DIFF_HEADER, formats,
+                                 _DIFF_INT_COLUMNS)) as writer:
+        writer.writerows(diff_budgets(versions, **kwargs))
+
+
+class _ChunkedWriter(object):
+    '''
+    File-like object that sends text using HTTP chunked transfer
+    encoding.
+
+    The text is encoded as UTF-8 and sent in chunks of about
+    ``chunk_size`` bytes.
+    '''
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._parts = []
+        self._size = 0
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self._parts.append(data)
+        self._size += len(data)
+        if self._size >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._size:
+            self._stream.write(b'%x\r\n' % self._size)
+            self._stream.write(b''.join(self._parts))
+            self._stream.write(b'\r\n')
+            self._parts = []
+            self._size = 0
+
+    def close(self):
+        self.flush()
+        self._stream.write(b'0\r\n\r\n')
+
+
+class _ExportRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    '''
+    Request handler of ``ExportServer``.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.info('{} - {}'.format(self.address_string(), format % args))
+
+    def _send_text(self, text, content_type='text/plain; charset=utf-8'):
+        data = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/':
+            self.send_error(404)
+            return
+        self._send_text('\n'.join(sorted(self.server.outputs)) + '\n')
+
+    def do_POST(self):
+        name = self.path.split('?', 1)[0][1:]
+        if name not in self.server.outputs:
+            self.send_error(404, 'Unknown dataset')
+            return
+        output = self.server.outputs[name]
+        try:
+            length = int(self.headers['Content-Length'])
+        except (KeyError, TypeError, ValueError):
+            self.send_error(411)
+            return
+        if length < 0:
+            self.send_error(400, 'Invalid Content-Length')
+            return
+        if length > self.server.max_upload_size:
+            self.send_error(413)
+            return
+        if not self.server.slots.acquire(False):
+            self.send_error(503, 'Too many pending uploads')
+            return
+        try:
+            data = self.rfile.read(length)
+            result = self.server.pool.apply_async(_load_word_file_in_worker,
+                                                  (io.BytesIO(data), True))
+            try:
+                tables, teilhaushalte = result.get()
+            except (zipfile.BadZipfile, KeyError, etree.XMLSyntaxError) as e:
+                log.warning('Could not parse upload: {}'.format(e))
+                self.send_error(400, 'Not a valid Word document')
+                return
+            except (ValueError, ArithmeticError) as e:
+                # Raised by the parsers for malformed values, for
+                # example ``decimal.InvalidOperation`` for amounts
+                log.warning('Could not parse tables of upload: {}'.format(e))
+                self.send_error(400, 'Could not parse the tables')
+                return
+            except Exception:
+                log.exception('Error while processing upload')
+                self.send_error(500)
+                return
+        finally:
+            self.server.slots.release()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        stream = _ChunkedWriter(self.wfile)
+        writer = _CsvStreamWriter(stream)
+        if isinstance(output, Dataset):
+            writer.writerow(output.header)
+            for table in tables:
+                if output.table_filter(table):
+                    output.dump_table(table, writer)
         else:
-            log.warning('Skipping "{}" (unsupported file extension)'.format(
-                  filename.decode(sys.stdin.encoding)))
-
-    dump_tables_to_csv('gesamtergebnishaushalt.csv',
-             lambda t: isinstance(t, GesamtergebnishaushaltTable),
-             ['TITEL', 'JAHR', 'TYP', 'BETRAG'],
-             ['title'])
-
-    dump_tables_to_csv('teilergebnishaushalte.csv',
-             lambda t: isinstance(t, TeilergebnishaushaltTable),
-             ['TEILHAUSHALT', 'PRODUKTBEREICH', 'PRODUKTGRUPPE', 'KONTOGRUPPE',
-              'TITEL', 'JAHR', 'TYP', 'BETRAG'],
-             ['kontogruppe', 'title'],
-             lambda t: [t.teilhaushalt, t.produktbereich, t.produktgruppe])
-
-    dump_tables_to_csv('gesamtfinanzshaushalt.csv',
-             lambda t: isinstance(t, FinanzhaushaltTable) and not t.teilhaushalt,
-             ['TITEL', 'JAHR', 'TYP', 'BETRAG'],
-             ['title'])
-
-    dump_tables_to_csv('teilfinanzhaushalte.csv',
-             lambda t: isinstance(t, FinanzhaushaltTable) and t.teilhaushalt,
-             ['TEILHAUSHALT', 'TITEL', 'JAHR', 'TYP', 'BETRAG'],
-             ['title'],
-             lambda t: [t.teilhaushalt])
-
-    dump_tables_to_csv('investitionsuebersichten.csv',
-             lambda t: isinstance(t, InvestitionsuebersichtTable),
-             ['TEILHAUSHALT', 'PROJEKTNUMMER', 'PROJEKT', 'TITEL', 'JAHR',
-              'TYP', 'BETRAG'],
-             ['project_id', 'project_title', 'title'],
-             lambda t: [t.teilhaushalt])
-
-    dump_list_of_teilhaushalte('teilhaushalte.csv')
+            writer.writerow(TEILHAUSHALTE_HEADER)
+            headings = _HeadingState()
+            headings.merge_teilhaushalte(teilhaushalte)
+            _dump_teilhaushalte(headings, writer)
+        stream.close()
+
+
+def _ignore_interrupts():
+    # Interrupts (Ctrl+C) are handled by the server process, which
+    # terminates the worker processes.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class ExportServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    HTTP server that exports uploaded Word files.
+
+    A Word file is uploaded via a ``POST`` request to ``/<name>`` where
+    ``<name>`` is the name of a dataset (see ``DATASETS``) or
+    ``TEILHAUSHALTE_NAME``. The response contains the dataset in CSV
+    format, it is streamed using chunked transfer encoding. A ``GET``
+    request to ``/`` returns the available names.
 
+    ``address`` is a 2-tuple containing the host and the port.
+
+    The uploads are parsed by a pool of ``jobs`` worker processes,
+    which are started once and reused for all requests. ``max_queue``
+    is the maximum number of uploads that are parsed or waiting for a
+    worker at the same time, further uploads are rejected with status
+    503. ``max_upload_size`` is the maximum size of an upload in bytes.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address, jobs=1, max_queue=16,
+                 max_upload_size=100 * 1024 * 1024):
+        import multiprocessing
+
+        self.outputs = {dataset.name: dataset for dataset in DATASETS}
+        self.outputs[TEILHAUSHALTE_NAME] = None
+        self.max_upload_size = max_upload_size
+        self.slots = threading.BoundedSemaphore(max_queue)
+        # The worker processes are started before the socket is opened,
+        # so that they do not inherit it.
+        self.pool = multiprocessing.Pool(jobs or None, _ignore_interrupts)
+        try:
+            BaseHTTPServer.HTTPServer.__init__(self, address,
+                                               _ExportRequestHandler)
+        except:
+            self.pool.terminate()
+            raise
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+
+
+def main(argv=None):
+    '''
+    Run the command line interface.
+
+    ``argv`` is the list of command line arguments, it defaults to
+    ``sys.argv[1:]``. See the ``budget-export`` script.
+    '''
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Export budget data to CSV.')
+    parser.add_argument('filenames', metavar='DOCX', nargs='*',
+                        help='Input files (Word .docx format)')
+    parser.add_argument('--verbose', '-v', action='count', help='Increase ' +
+                        'verbosity (can be specified two times)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='Number ' +
+                        'of files to parse in parallel (0 uses all CPUs)')
+    parser.add_argument('--parallel-tables', action='store_true',
+                        help='Parse individual tables in parallel instead ' +
+                        'of whole files (for few, very large files)')
+    parser.add_argument('--compact', action='store_true', help='Store ' +
+                        'the parsed tables in a compact form to reduce ' +
+                        'memory usage')
+    parser.add_argument('--cache', metavar='DIRECTORY', help='Cache the ' +
+                        'parsed data in the given directory, unchanged ' +
+                        'files are not parsed again')
+    parser.add_argument('--cache-size', metavar='MB', type=int, default=512,
+                        help='Maximum size of the cache (default: 512 MB)')
+    parser.add_argument('--format', '-f', action='append',
+                        choices=sorted(OUTPUT_FORMATS), help='Output ' +
+                        'format (can be specified multiple times, ' +
+                        'defaults to CSV)')
+    parser.add_argument('--kind', '-k', action='append',
+                        choices=[dataset.name for dataset in DATASETS],
+                        help='Export only the given dataset (can be ' +
+                        'specified multiple times)')
+    parser.add_argument('--teilhaushalt', action='append', metavar='ID',
+                        help='Export only the tables of the given ' +
+                        'Teilhaushalt (can be specified multiple times)')
+    parser.add_argument('--produktbereich', action='append', metavar='ID',
+                        help='Export only the tables of the given ' +
+                        'Produktbereich (can be specified multiple times)')
+    parser.add_argument('--produktgruppe', action='append', metavar='ID',
+                        help='Export only the tables of the given ' +
+                        'Produktgruppe (can be specified multiple times)')
+    parser.add_argument('--validate', action='store_true', help='Check ' +
+                        'the sums in the summary rows and warn about ' +
+                        'mismatches')
+    parser.add_argument('--diff', action='store_true', help='Compare ' +
+                        'several versions of a budget instead of ' +
+                        'exporting them. Each DOCX argument is a version, ' +
+                        'either a Word file or a directory of Word files')
+    parser.add_argument('--sqlite', metavar='FILE', help='Write the data ' +
+                        'to a SQLite database (in addition to the formats ' +
+                        'given by --format)')
+    parser.add_argument('--rollup', action='store_true', help='Write the ' +
+                        'sums of the Teilergebnishaushalte per ' +
+                        'Teilhaushalt, Produktbereich and Produktgruppe ' +
+                        'to "{}"'.format(ROLLUP_FILENAME))
+    parser.add_argument('--list-layouts', action='store_true', help='List ' +
+                        'the registered table layouts and exit')
+    parser.add_argument('--profile', metavar='FILE', help='Write the ' +
+                        'timings and counters of the processing stages ' +
+                        'to FILE in JSON format ("-" for standard output)')
+    parser.add_argument('--serve', metavar='[HOST:]PORT', help='Run an ' +
+                        'HTTP server that exports uploaded files instead ' +
+                        'of exporting DOCX (HOST defaults to localhost)')
+    parser.add_argument('--max-queue', metavar='N', type=int, default=16,
+                        help='Maximum number of uploads that are processed ' +
+                        'by the server at the same time (default: 16)')
+    args = parser.parse_args(argv)
+    if args.list_layouts:
+        for layout in _layouts:
+            line = '{}: {}'.format(layout.__name__, ', '.join(
+                   'column {} contains "{}"'.format(column + 1, keyword)
+                   for column, keyword
+                   in sorted(layout.header_signature.iteritems())))
+            print(line.encode(sys.stdout.encoding or 'utf-8', 'replace'))
+        return
+    if not args.filenames and not args.serve:
+        parser.error('no input files given')
+    start = _clock()
+
+    log.addHandler(logging.StreamHandler())
+    if args.verbose == 0:
+        log.setLevel(logging.WARNING)
+    elif args.verbose == 1:
+        log.setLevel(logging.INFO)
+    elif args.verbose >= 2:
+        log.setLevel(logging.DEBUG)
+
+    if args.serve:
+        host, _, port = args.serve.rpartition(b':')
+        server = ExportServer((host or 'localhost', int(port)), args.jobs,
+                              args.max_queue)
+        log.warning('Listening on http://{}:{}/'.format(
+                    *server.server_address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return
+
+    def docx_files(filenames):
+        result = []
+        for filename in filenames:
+            if filename.endswith(b'.docx'):
+                result.append(filename)
+            else:
+                log.warning(('Skipping "{}" (unsupported file ' +
+                            'extension)').format(
+                            filename.decode(sys.stdin.encoding)))
+        return result
+
+    if args.cache:
+        cache = ParseCache(args.cache, args.cache_size * 1024 * 1024)
+    else:
+        cache = None
+    if args.kind or args.teilhaushalt or args.produktbereich or \
+            args.produktgruppe:
+        selection = Selection(args.kind, args.teilhaushalt,
+                              args.produktbereich, args.produktgruppe)
+    else:
+        selection = None
+    if args.diff:
+        if len(args.filenames) < 2:
+            parser.error('--diff requires at least two versions')
+        versions = []
+        for path in args.filenames:
+            if os.path.isdir(path):
+                filenames = docx_files([os.path.join(path, name) for name
+                                        in sorted(os.listdir(path))])
+            else:
+                filenames = docx_files([path])
+            versions.append((path.decode(sys.getfilesystemencoding()),
+                             filenames))
+        dump_diff(versions, args.format or ['csv'], jobs=args.jobs,
+                  parallel_tables=args.parallel_tables, compact=args.compact,
+                  cache=cache, selection=selection)
+    else:
+        headings = _HeadingState()
+        tables = load_word_files(docx_files(args.filenames), headings,
+                                 args.jobs, args.parallel_tables,
+                                 args.compact, cache, selection)
+        if args.validate:
+            tables = validate_tables(tables)
+        if args.rollup:
+            rollup = RollupIndex()
+            tables = rollup.collect(tables)
+        if args.format:
+            formats = args.format
+        elif args.sqlite:
+            formats = []
+        else:
+            formats = ['csv']
+        export_tables(tables, headings, formats, args.sqlite, args.kind)
+        if args.rollup:
+            with metrics.timer('write'):
+                rollup.write(ROLLUP_FILENAME, headings)
+
+    if args.profile:
+        report = metrics.report()
+        report['seconds'] = _clock() - start
+        report['jobs'] = args.jobs
+        if args.profile == b'-':
+            json.dump(report, sys.stdout, indent=2, sort_keys=True)
+            print()
+        else:
+            with open(args.profile, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()